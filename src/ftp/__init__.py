@@ -1,3 +1,4 @@
 from ftp.client import *
+from ftp.manifest import *
 from ftp.options import *
 from ftp.pgp import *
@@ -1,26 +1,37 @@
+import atexit
+import calendar
 import contextlib
+import datetime
 import ftplib
+import hashlib
+import io
+import itertools
+import json
 import logging
 import os
 import posixpath
-import random
+import queue
 import re
+import shlex
 import shutil
+import ssl
 import stat
 import sys
-import tempfile
+import threading
 import time
 from abc import ABC, abstractmethod
-from functools import wraps
-from io import BytesIO, IOBase, StringIO
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import StringIO
+from operator import attrgetter
 from pathlib import Path
-from typing import NamedTuple
 
 import paramiko
 
 from opendate import LCL, DateTime
+from ftp.manifest import file_checksum, site_key, sync_manifest
 from ftp.options import FtpOptions
-from ftp.pgp import decrypt_pgp_file
+from ftp.pgp import decrypt_pgp_file, decrypt_pgp_stream, encrypt_pgp_stream
 from libb import FileLike, load_options
 
 logger = logging.getLogger(__name__)
@@ -31,15 +42,60 @@ __all__ = [
     'connectmanager',
     'sync_site',
     'BaseConnection',
+    'ConnectionPool',
 ]
 
 
-class Entry(NamedTuple):
-    line: str = None
-    name: str = None
-    is_dir: bool = False
-    size: int = 0
-    datetime: DateTime = None
+class Entry:
+    """Directory entry keyed on an integer epoch `mtime`
+
+    The `datetime` is only built when first accessed, and the raw listing
+    `line` is only kept when debug logging is enabled.
+    """
+    __slots__ = ('line', 'name', 'is_dir', 'size', 'mtime', 'tzinfo', '_datetime')
+
+    def __init__(self, line: str = None, name: str = None, is_dir: bool = False,
+                 size: int = 0, datetime: DateTime = None, mtime: int = None,
+                 tzinfo=None):
+        self.line = line
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self._datetime = datetime
+        if datetime is not None:
+            self.mtime = int(datetime.timestamp()) if mtime is None else mtime
+            self.tzinfo = datetime.tzinfo
+        else:
+            self.mtime = mtime
+            self.tzinfo = tzinfo
+
+    @property
+    def datetime(self) -> DateTime:
+        if self._datetime is None and self.mtime is not None:
+            self._datetime = DateTime.fromtimestamp(self.mtime, tz=self.tzinfo)
+        return self._datetime
+
+    def __eq__(self, other):
+        if not isinstance(other, Entry):
+            return NotImplemented
+        return (self.name, self.is_dir, self.size, self.mtime) == \
+            (other.name, other.is_dir, other.size, other.mtime)
+
+    def __hash__(self):
+        return hash((self.name, self.is_dir, self.size, self.mtime))
+
+    def __iter__(self):
+        """Unpack as the former (line, name, is_dir, size, datetime) tuple"""
+        return iter((self.line, self.name, self.is_dir, self.size, self.datetime))
+
+    def __repr__(self):
+        return (f'Entry(name={self.name!r}, is_dir={self.is_dir}, size={self.size}, '
+                f'mtime={self.mtime})')
+
+
+def sort_entries(entries: list[Entry]) -> list[Entry]:
+    """Newest first, comparing integer mtimes"""
+    return sorted(entries, key=attrgetter('mtime'), reverse=True)
 
 
 FTP_DIR_RE = (
@@ -79,11 +135,11 @@ def connect(options: FtpOptions = None, config=None, **kw):
                 sftp_kwargs = {
                     'username': options.username,
                     'password': options.password,
-                    'tzinfo': options.tzinfo,
                     'ssh_key_filename': options.ssh_key_filename,
                     'ssh_key_content': options.ssh_key_content,
                     'ssh_key_type': options.ssh_key_type,
                     'ssh_key_passphrase': options.ssh_key_passphrase,
+                    **SecureFtpConnection.settings_from(options),
                 }
                 if options.port is not None:
                     sftp_kwargs['port'] = options.port
@@ -91,7 +147,7 @@ def connect(options: FtpOptions = None, config=None, **kw):
                 if not cn:
                     raise paramiko.SSHException
             else:
-                ftp_kwargs = {'tzinfo': options.tzinfo}
+                ftp_kwargs = FtpConnection.settings_from(options)
                 if options.port is not None:
                     ftp_kwargs['port'] = options.port
                 cn = FtpConnection(options.hostname, options.username,
@@ -127,28 +183,307 @@ def connectmanager(options: FtpOptions = None, config=None, **kw):
     note: having trouble with SSL auth?  test with ossl command:
     openssl s_client -starttls ftp -connect host.name:port
     """
+    pool = connection_pool(options)
+    if pool is not None:
+        with pool.lease(options, config) as cn:
+            yield cn
+        return
     cn = connect(options, config, **kw)
-    yield cn
     try:
-        cn.close()
-    except:
-        pass
+        yield cn
+    finally:
+        with contextlib.suppress(Exception):
+            cn.close()
 
 
-def parse_ftp_dir_entry(line, tzinfo):
-    for pattern in FTP_DIR_RE:
-        if m := re.search(pattern, line):
+class ConnectionPool:
+    """Idle connections kept per site so repeated syncs skip the handshake
+
+    Connections are keyed by (secure, hostname, port, username, key) and are
+    checked with `ping()` before being handed out, then take the leasing
+    site's transfer settings (`configure`). Idle connections older
+    than `max_idle` seconds, or opened more than `max_lifetime` seconds ago,
+    are closed instead of reused.
+    """
+
+    def __init__(self, max_idle: float = 300, max_lifetime: float = 3600,
+                 max_size: int = 8):
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.max_size = max_size
+        self._idle = defaultdict(list)  # key -> [(cn, opened, released)]
+        self._leased = {}  # cn -> (key, opened)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(options: FtpOptions) -> tuple:
+        return (
+            options.secure,
+            options.hostname,
+            options.port,
+            options.username,
+            str(options.ssh_key_filename or ''),
+            options.ssh_key_content,
+        )
+
+    def _expired(self, opened, released, now):
+        return now - released > self.max_idle or now - opened > self.max_lifetime
+
+    def acquire(self, options: FtpOptions, config=None):
+        """Return a healthy idle connection for the site, else connect"""
+        key = self.key(options)
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                if not self._idle[key]:
+                    break
+                cn, opened, released = self._idle[key].pop()
+            if self._expired(opened, released, now) or not cn.ping():
+                logger.debug(f'Evicting pooled connection to {options.hostname}')
+                cn.close()
+                continue
             try:
-                entry = Entry(line,
-                              m.group(4),
-                              m.group(1)[0] == 'd',
-                              int(m.group(2)),
-                              DateTime.parse(m.group(3)).replace(tzinfo=tzinfo))
-            except Exception as exc:
-                logger.error(f'Error with line {line}, groups: {m.groups()}')
-                logger.exception(exc)
-                raise exc
-            return entry
+                cn.configure(options)
+                if options.remotedir:
+                    cn.cd(options.remotedir)
+            except Exception:
+                cn.close()
+                continue
+            logger.debug(f'Reusing pooled connection to {options.hostname}')
+            with self._lock:
+                self._leased[cn] = (key, opened)
+            return cn
+        cn = connect(options, config)
+        if cn:
+            with self._lock:
+                self._leased[cn] = (key, time.monotonic())
+        return cn
+
+    def release(self, cn, discard=False):
+        """Return a leased connection to the pool, or close it if `discard`"""
+        with self._lock:
+            key, opened = self._leased.pop(cn, (None, None))
+        now = time.monotonic()
+        if discard or key is None or self._expired(opened, now, now):
+            cn.close()
+            return
+        with self._lock:
+            idle = self._idle[key]
+            idle.append((cn, opened, now))
+            evicted = idle[:-self.max_size]
+            del idle[:-self.max_size]
+        for old, _, _ in evicted:
+            old.close()
+
+    @contextlib.contextmanager
+    def lease(self, options: FtpOptions, config=None):
+        cn = self.acquire(options, config)
+        try:
+            yield cn
+        except:
+            if cn:
+                self.release(cn, discard=True)
+            raise
+        else:
+            if cn:
+                self.release(cn)
+
+    def clear(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle = [cn for conns in self._idle.values() for cn, _, _ in conns]
+            self._idle.clear()
+        for cn in idle:
+            cn.close()
+
+
+default_pool = ConnectionPool()
+atexit.register(default_pool.clear)
+
+
+def connection_pool(options: FtpOptions):
+    """Resolve the `pool` option to a ConnectionPool, or None"""
+    if isinstance(options.pool, ConnectionPool):
+        return options.pool
+    if options.pool:
+        return default_pool
+
+
+FTP_DIR_PATTERNS = tuple(re.compile(pattern) for pattern in FTP_DIR_RE)
+
+MONTHS = {name: i for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+
+
+def parse_ftp_dir_entry(line, tzinfo):
+    entries, _ = parse_ftp_dir_listing([line], tzinfo)
+    if entries:
+        return entries[0]
+
+
+def parse_ftp_dir_listing(lines, tzinfo, now: DateTime = None) -> tuple[list[Entry], list[str]]:
+    """Parse a whole LIST response in one pass
+
+    return:
+        Entries and the lines that matched no pattern
+    """
+    unparsed = []
+    entries = list(iter_ftp_dir_listing(lines, tzinfo, unparsed, now))
+    return entries, unparsed
+
+
+def iter_ftp_dir_listing(lines, tzinfo, unparsed: list, now: DateTime = None):
+    """Parse LIST lines lazily, collecting unmatched lines in `unparsed`
+
+    The pattern that matched last is tried first, since a server uses one
+    format throughout, and each distinct date string is parsed once.
+    """
+    patterns = list(FTP_DIR_PATTERNS)
+    tomorrow = (now or DateTime.now(tz=tzinfo)).add(days=1)
+    keep_lines = logger.isEnabledFor(logging.DEBUG)
+    dates = {}
+    for line in lines:
+        for i, pattern in enumerate(patterns):
+            if m := pattern.search(line):
+                if i:
+                    patterns.insert(0, patterns.pop(i))
+                break
+        else:
+            if not line.startswith('total '):
+                unparsed.append(line)
+            continue
+        datestr = m.group(3)
+        try:
+            if (date := dates.get(datestr)) is None:
+                dt = parse_ftp_dir_date(datestr, tzinfo, tomorrow)
+                date = dates[datestr] = (dt, int(dt.timestamp()))
+            entry = Entry(line if keep_lines else None, m.group(4),
+                          m.group(1)[0] == 'd', int(m.group(2)), *date)
+        except Exception as exc:
+            logger.error(f'Error with line {line}, groups: {m.groups()}')
+            logger.exception(exc)
+            raise exc
+        yield entry
+
+
+def parse_ftp_dir_date(datestr, tzinfo, tomorrow: DateTime):
+    """Parse a LIST date ("Sep 07 17:54" or "Sep 07 2001")
+
+    Entries without a year are at most six months old by ls convention,
+    so a date after `tomorrow` belongs to the previous year, and a yearless
+    Feb 29 to the latest leap year.
+    """
+    mon, day, rest = datestr.split()
+    month = MONTHS.get(mon[:3].lower())
+    if month is None:
+        return DateTime.parse(datestr).replace(tzinfo=tzinfo)
+    day = int(day)
+    try:
+        if ':' in rest:
+            hour, minute = rest.split(':')
+            year = tomorrow.year if (month, day) <= (tomorrow.month, tomorrow.day) else tomorrow.year - 1
+            while (month, day) == (2, 29) and not calendar.isleap(year):
+                year -= 1
+            return DateTime(year, month, day, int(hour), int(minute), tzinfo=tzinfo)
+        return DateTime(int(rest), month, day, tzinfo=tzinfo)
+    except ValueError:  # e.g. Feb 29 resolved to a non-leap year
+        return DateTime.parse(datestr).replace(tzinfo=tzinfo)
+
+
+MLSD_FACTS = ['type', 'size', 'modify']
+
+# replies meaning the command itself is unsupported, not that the path is bad
+NOT_IMPLEMENTED = ('500', '502', '504')
+
+
+def parse_mlsd_line(line, tzinfo):
+    """Parse one MLSD line ("fact=value;...; name") as `ftplib.FTP.mlsd` does"""
+    found, _, name = line.partition(' ')
+    facts = {}
+    for fact in found[:-1].split(';'):
+        key, _, value = fact.partition('=')
+        facts[key.lower()] = value
+    return parse_mlsd_entry(name, facts, tzinfo)
+
+
+def parse_mlsd_entry(name, facts, tzinfo):
+    """Build an entry from MLSD facts; `modify` is UTC per RFC 3659
+
+    Raises ValueError when `modify` is missing or malformed (it is optional),
+    so the caller can count the line as unparsed rather than drop it.
+    """
+    kind = facts.get('type', '').lower()
+    if kind in {'cdir', 'pdir'}:
+        return
+    modify = facts.get('modify', '')
+    mtime = calendar.timegm((int(modify[0:4]), int(modify[4:6]), int(modify[6:8]),
+                             int(modify[8:10]), int(modify[10:12]), int(modify[12:14])))
+    line = None
+    if logger.isEnabledFor(logging.DEBUG):
+        line = ''.join(f'{k}={v};' for k, v in facts.items()) + f' {name}'
+    return Entry(line, name, kind == 'dir', int(facts.get('size') or 0),
+                 mtime=mtime, tzinfo=tzinfo)
+
+
+def parse_ftp_tree_listing(lines, tzinfo, root='') -> tuple[list[Entry] | None, list[str]]:
+    """Parse a recursive `LIST -R` response into one flat listing
+
+    Section headers ("./sub:") name the directory the following lines
+    belong to, and entry names are returned relative to `root`.
+
+    return:
+        Entries, or None when the server ignored -R (a directory was listed
+        but no section followed for it), and the lines that matched nothing
+    """
+    sections, current = {'': []}, ''
+    for line in lines:
+        if not line:
+            continue
+        if line.endswith(':') and not any(p.search(line) for p in FTP_DIR_PATTERNS):
+            current = _tree_relpath(line[:-1], root)
+            sections.setdefault(current, [])
+            continue
+        sections[current].append(line)
+    entries, unparsed = [], []
+    for rel, section in sections.items():
+        for entry in iter_ftp_dir_listing(section, tzinfo, unparsed):
+            if entry.name in {'.', '..'}:
+                continue
+            if rel:
+                entry.name = posixpath.join(rel, entry.name)
+            entries.append(entry)
+    if any(e.is_dir and e.name not in sections for e in entries):
+        return None, unparsed
+    return entries, unparsed
+
+
+def _tree_relpath(header, root):
+    header, root = header.rstrip('/'), root.rstrip('/')
+    if root and (header == root or header.startswith(f'{root}/')):
+        header = header[len(root):]
+    header = header.lstrip('/')
+    while header.startswith('./'):
+        header = header[2:]
+    return '' if header == '.' else header
+
+
+def parse_find_listing(data: bytes, tzinfo) -> list[Entry]:
+    """Parse NUL-terminated `find -printf '%y %s %T@ %P\\0'` records
+
+    The first record must be the root directory itself (an empty `%P`);
+    without it the output did not come from `find` (a server forcing
+    `internal-sftp` runs that instead and prints nothing) and ValueError
+    is raised.
+    """
+    records = [record for record in data.split(b'\0') if record]
+    if not records or not re.fullmatch(rb'd \d+ [\d.]+ ', records[0]):
+        raise ValueError('find output does not start with the root directory')
+    entries = []
+    for record in records[1:]:
+        kind, size, mtime, name = record.decode(errors='surrogateescape').split(' ', 3)
+        entries.append(Entry(None, name, kind == 'd', int(size),
+                             mtime=int(float(mtime)), tzinfo=tzinfo))
+    return entries
 
 
 @load_options(cls=FtpOptions)
@@ -177,127 +512,1058 @@ def sync_site(options=None, config=None, **kw):
     `ignorelocal`: ignore presence of local file when deciding to copy
     `ignoresize`: ignore size of local file when deciding to copy
     `ignoreolderthan`: ignore files older than number of days
+    `skip_dated_dirs`: with `ignoreolderthan`, skip directories named for a date before the cutoff
     `address`: Send notification of new files to address
+    `workers`: number of extra connections used to download files in parallel
+    `multiplex`: SFTP workers are channels on the sync connection, not new logins
+    `resume`: download via a partial file that later runs resume from
+    `tree_listing`: list the whole remote tree up front instead of per directory
+    `listers`: connections listing directories concurrently, breadth-first
+    `manifest`: SQLite file recording what was fetched, to skip unchanged files
+    `prune_dirs`: with a manifest, skip subtrees whose directory mtime is unchanged
+    `force_full_scan`: days after which a pruned directory is listed again
+    `decrypt_workers`: gpg workers decrypting downloads while transfers go on (0: inline)
+    `decrypt_backlog`: downloads that may wait for a gpg worker before transfers pause
+    `stream_decrypt`: pipe encrypted downloads straight into gpg
+    `keep_ciphertext`: with `stream_decrypt`, also keep the `.pgp` copy
 
     """
     logger.info(f'Syncing FTP site for {options.sitename or ""}')
     files = []
-    with connectmanager(options, config) as cn:
-        sync_directory(cn, options, files)
-        logger.info(
-            '%d copied, %d decrypted, %d skipped, %d ignored',
-            options.stats['copied'],
-            options.stats['decrypted'],
-            options.stats['skipped'],
-            options.stats['ignored'],
-        )
+    if options.tree_listing:
+        sync = sync_tree
+    elif options.listers > 1:
+        sync = sync_crawl
+    else:
+        sync = sync_directory
+    manifest = sync_manifest(options)
+    decrypter = None
+    if options.decrypt_workers and not options.nocopy and not options.nodecryptlocal:
+        decrypter = DecryptPool(options, options.decrypt_workers, options.decrypt_backlog)
+    run = SyncRun(options, decrypter)
+    if options.stream_decrypt and not options.keep_ciphertext and not manifest:
+        logger.warning('stream_decrypt without keep_ciphertext needs a manifest to skip '
+                       'files already fetched; every encrypted file will be downloaded again')
+    try:
+        with connectmanager(options, config) as cn, decrypter or contextlib.nullcontext():
+            _remote = cn.pwd() or options.remotedir
+            if options.workers > 1:
+                with TransferPool(options, config, options.workers, cn=cn, run=run) as pool:
+                    sync(cn, options, files, options.localdir, _remote, pool=pool, run=run)
+                files.extend(pool.files)
+            else:
+                sync(cn, options, files, options.localdir, _remote, run=run)
+            if decrypter:
+                decrypter.join()
+                files.extend(decrypter.files)
+            if manifest:
+                manifest.save_dirs(site_key(options))
+            logger.info(
+                '%d copied, %d decrypted, %d skipped, %d ignored, %d expired, %d dated dirs expired',
+                options.stats['copied'],
+                options.stats['decrypted'],
+                options.stats['skipped'],
+                options.stats['ignored'],
+                options.stats['expired'],
+                options.stats['expired_dirs'],
+            )
+            logger.info(
+                'download %.1fs, decrypt %.1fs, waiting on decrypt %.1fs',
+                options.stats['download_seconds'],
+                options.stats['decrypt_seconds'],
+                options.stats['decrypt_wait_seconds'],
+            )
+    finally:
+        run.snapshot.remove_partial_dirs()
+        if manifest:
+            manifest.save_dirs(site_key(options), discard=True)
+            manifest.flush()
     return files
 
 
-def returntodir(func):
-    @wraps(func)
-    def wrapper(cn, options, files, _local: Path = None, _remote: str = None):
-        _local = _local or options.localdir
-        _remote = _remote or options.remotedir
-        workdir = cn.pwd()
-        logger.debug(f'CD to: {_remote}')
-        cn.cd(_remote)
+class ChunkReader(io.RawIOBase):
+    """Readable binary stream over an iterable of byte (or str) chunks
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        super().close()
+
+    def readinto(self, b):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk.encode() if isinstance(chunk, str) else chunk).cast('B')
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+@contextlib.contextmanager
+def data_connection(ftp: ftplib.FTP, cmd: str, rest=None):
+    """Open the data connection for a transfer command and finish it
+
+    If the consumer stops early the connection is closed, which makes the
+    server abort the transfer, and its reply is read so the control
+    connection stays usable.
+    """
+    conn = ftp.transfercmd(cmd, rest)
+    try:
+        yield conn
+    except GeneratorExit:
+        conn.close()
+        with contextlib.suppress(ftplib.error_temp):
+            ftp.voidresp()
+        raise
+    except BaseException:
+        conn.close()
+        raise
+    if isinstance(conn, ssl.SSLSocket):
+        conn.unwrap()
+    conn.close()
+    ftp.voidresp()
+
+
+def iter_transfer(ftp: ftplib.FTP, cmd: str, blocksize=8192, rest=None):
+    """Yield the data of a binary transfer command as it arrives
+
+    Follows `ftplib.FTP.retrbinary` but hands chunks to the caller instead
+    of a callback, so the transfer can be consumed lazily or abandoned.
+    """
+    ftp.voidcmd('TYPE I')
+    with data_connection(ftp, cmd, rest) as conn:
+        while data := conn.recv(blocksize):
+            yield data
+
+
+def iter_transfer_lines(ftp: ftplib.FTP, cmd: str):
+    """Yield the lines of a text transfer command (LIST, MLSD) as they arrive
+
+    The generator counterpart of `ftplib.FTP.retrlines`.
+    """
+    ftp.sendcmd('TYPE A')
+    with data_connection(ftp, cmd) as conn, \
+            conn.makefile('r', encoding=ftp.encoding) as fp:
+        while line := fp.readline(ftp.maxline + 1):
+            if len(line) > ftp.maxline:
+                raise ftplib.Error(f'got more than {ftp.maxline} bytes')
+            yield line.rstrip('\r\n')
+
+
+@contextlib.contextmanager
+def upload_source(source, blocksize=8192):
+    """Open an upload source as a binary file object without spooling it
+
+    `source` may be a local path, a binary or text file-like object, or an
+    iterable of byte chunks.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with Path(source).open('rb') as f:
+            yield f
+    elif hasattr(source, 'read'):
+        if isinstance(source, io.TextIOBase):
+            chunks = iter(lambda: source.read(blocksize), '')
+            yield io.BufferedReader(ChunkReader(chunks), blocksize)
+        else:
+            yield source
+    else:
+        yield io.BufferedReader(ChunkReader(source), blocksize)
+
+
+def encrypted_source(f, recipients, blocksize=8192):
+    """Wrap an upload source in `encrypt_pgp_stream` when there are recipients"""
+    if not recipients:
+        return contextlib.nullcontext(f)
+    return encrypt_pgp_stream(f, recipients, blocksize)
+
+
+@contextlib.contextmanager
+def encrypted_upload(cn, remotefile, recipients):
+    """Remove a partly written ciphertext if an encrypted upload fails
+
+    Set the yielded list's only item once the remote file has been opened;
+    an existing file that was never overwritten is left alone.
+    """
+    opened = [False]
+    try:
+        yield opened
+    except BaseException:
+        if recipients and opened[0]:
+            with contextlib.suppress(Exception):
+                cn.delete(remotefile)
+        raise
+
+
+class TransferPool:
+    """Bounded set of worker connections that run `sync_file` concurrently
+
+    Each worker owns its own connection, so transfers never share a control
+    channel. With `options.multiplex` on an SFTP site the workers are extra
+    SFTP channels spawned from `cn` instead of separate logins. `submit`
+    blocks once `options.transfer_backlog` files are waiting, so a fast
+    listing cannot queue a whole tree in memory. Results are collected in
+    submission order in `files`.
+    """
+
+    def __init__(self, options: FtpOptions, config=None, workers: int = 1, cn=None,
+                 run: 'SyncRun' = None):
+        self.options = options
+        self.files = []
+        self._state = run or SyncRun(options)
+        self._results = []
+        self._pending = set()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + options.transfer_backlog)
+        self._connections = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='ftp-worker')
+        opener, self._pool = _opener(options, cn)
+        for worker in self._executor.map(lambda _: opener(options, config), range(workers)):
+            if worker:
+                self._connections.put(worker)
+        if self._connections.empty():
+            self._executor.shutdown()
+            raise ConnectionError(f'Could not open worker connections to {options.hostname}')
+        logger.debug(f'Opened {self._connections.qsize()} worker connections')
+
+    def submit(self, entry, _local: Path, _remote: str):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, entry, _local, _remote)
+        except:
+            self._slots.release()
+            raise
+        seq = next(self._seq)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._done(f, seq, entry, _remote))
+
+    def _done(self, future, seq, entry, _remote):
+        filename = None
+        try:
+            filename = future.result()
+        except:
+            logger.exception('Error syncing file: %s/%s', _remote, entry.name)
+            _fail_dir(self.options, _remote)
+        # the result is in place before join() can see the future finished
+        with self._lock:
+            if filename:
+                self._results.append((seq, filename))
+            self._pending.discard(future)
+        self._slots.release()
+
+    def _run(self, entry, _local, _remote):
+        cn = self._connections.get()
         try:
-            func(cn, options, files, _local, _remote)
+            return sync_file(cn, self.options, entry, _local, _remote, self._state)
         finally:
-            logger.debug(f'CD to: {workdir}')
-            cn.cd(workdir)
-    return wrapper
-
-
-def streamtofile(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        for i, arg in enumerate(args):
-            if isinstance(arg, IOBase):
-                rf = os.path.join(tempfile.tempdir(), random.getrandbits(32))
-                with Path(rf).open('w' if isinstance(arg, StringIO) else 'wb') as f:
-                    f.write(arg.read())
-                args[i] = f
-        for k, v in kwargs.items():
-            if isinstance(v, IOBase):
-                rf = os.path.join(tempfile.tempdir(), random.getrandbits(32))
-                with Path(rf).open('w' if isinstance(arg, StringIO) else 'wb') as f:
-                    f.write(arg.read())
-                kwargs[k] = f
-        return func(*args, **kwargs)
-    return wrapper
-
-
-@returntodir
-def sync_directory(cn, options, files, _local: Path = None, _remote: str = None):
+            self._connections.put(cn)
+
+    def join(self):
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            wait(pending)
+        with self._lock:
+            self.files.extend(filename for _, filename in sorted(self._results, key=lambda r: r[0]))
+            self._results = []
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._connections.empty():
+            _release(self._pool, self._connections.get())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.join()
+        finally:
+            self.close()
+
+
+def _opener(options: FtpOptions, cn=None):
+    """Return how to open extra connections to `cn`'s site, and the pool
+    they are released to (None when they are closed instead)
+
+    With `options.multiplex` on an SFTP site they are channels spawned from
+    `cn` rather than separate logins.
+    """
+    if options.multiplex and isinstance(cn, SecureFtpConnection):
+        def spawn(options, config):
+            try:
+                return cn.spawn()
+            except paramiko.SSHException as err:
+                # servers cap channels per session (OpenSSH MaxSessions)
+                logger.warning(f'Could not open SFTP channel: {err}')
+        return spawn, None
+    if pool := connection_pool(options):
+        return pool.acquire, pool
+    return connect, None
+
+
+def _release(pool, cn):
+    if pool:
+        pool.release(cn)
+    else:
+        cn.close()
+
+
+class DirectoryCrawler:
+    """Breadth-first walk of a remote tree with several listing connections
+
+    Directories still to visit wait in a bounded frontier queue. A lister
+    that finds the frontier full keeps the overflow to visit itself, so
+    listers never block on each other and the walk needs no recursion.
+    Files go to the `pool` as they are discovered, or are synced by the
+    lister's own connection when there is no pool.
+    """
+
+    def __init__(self, options: FtpOptions, config=None, listers: int = 1, cn=None,
+                 pool: TransferPool = None, frontier: int = 1024, run: 'SyncRun' = None):
+        self.options = options
+        self.files = []
+        self._pool = pool
+        self._state = run or SyncRun(options)
+        self._frontier = queue.Queue(maxsize=max(frontier, listers))
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._connections = [cn]
+        self._extra = []
+        self._conn_pool = None
+        if listers > 1:
+            opener, self._conn_pool = _opener(options, cn)
+            with ThreadPoolExecutor(max_workers=listers - 1) as executor:
+                opened = executor.map(lambda _: opener(options, config), range(listers - 1))
+                self._extra = [extra for extra in opened if extra]
+            self._connections += self._extra
+        logger.debug(f'Crawling with {len(self._connections)} listing connections')
+
+    def run(self, _local: Path, _remote: str):
+        self._push(_local, _remote, [])
+        with ThreadPoolExecutor(max_workers=len(self._connections),
+                                thread_name_prefix='ftp-lister') as executor:
+            list(executor.map(self._lister, self._connections))
+        return self.files
+
+    def _push(self, _local, _remote, overflow, _mtime=None):
+        with self._lock:
+            self._pending += 1
+        try:
+            self._frontier.put_nowait((_local, _remote, _mtime))
+        except queue.Full:
+            overflow.append((_local, _remote, _mtime))
+
+    def _lister(self, cn):
+        overflow = []
+        while True:
+            item = overflow.pop() if overflow else self._frontier.get()
+            if item is None:
+                return
+            try:
+                self._visit(cn, *item, overflow)
+            except:
+                logger.exception('Error syncing directory: %s', item[1])
+                _fail_dir(self.options, item[1])
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if not self._pending:
+                        for _ in self._connections:
+                            self._frontier.put(None)
+
+    def _visit(self, cn, _local, _remote, _mtime, overflow):
+        for _sublocal, subdir, mtime in _sync_listing(cn, self.options, self.files, _local,
+                                                      _remote, _mtime, self._pool,
+                                                      self._state):
+            self._push(_sublocal, subdir, overflow, mtime)
+
+    def close(self):
+        for cn in self._extra:
+            _release(self._conn_pool, cn)
+        self._extra = []
+
+
+def sync_crawl(cn, options, files, _local: Path = None, _remote: str = None,
+               pool: TransferPool = None, run: 'SyncRun' = None):
+    """Sync a remote FTP directory breadth-first with `options.listers`
+    connections listing directories concurrently"""
+    if run is None:
+        with _sync_run(options) as run:
+            return sync_crawl(cn, options, files, _local, _remote, pool, run)
+    crawler = DirectoryCrawler(options, listers=options.listers, cn=cn, pool=pool, run=run)
+    try:
+        files.extend(crawler.run(_local or options.localdir, _remote or options.remotedir))
+    finally:
+        crawler.close()
+
+
+def sync_directory(cn, options, files, _local: Path = None, _remote: str = None,
+                   pool: TransferPool = None, _mtime: int = None, run: 'SyncRun' = None):
     """Sync a remote FTP directory to a local directory recursively
+
+    Directories are listed by path, so the working directory never changes.
+    When a `pool` is given, files are handed to its worker connections and
+    this connection is only used for listing. `_mtime` is the directory's
+    own modification time from its parent's listing, used for pruning.
     """
-    logger.info(f'Syncing directory {_remote or options.remotedir}')
-    entries = cn.dir(sort=True)
-    for entry in entries:
-        if options.ignore_re and re.match(options.ignore_re, entry.name):
-            logger.debug(f'Ignoring file that matches ignore pattern: {entry.name}')
-            options.stats['ignored'] += 1
+    if run is None:
+        with _sync_run(options) as run:
+            return sync_directory(cn, options, files, _local, _remote, pool, _mtime, run)
+    _local = _local or options.localdir
+    _remote = _remote or options.remotedir
+    for _sublocal, subdir, mtime in _sync_listing(cn, options, files, _local, _remote,
+                                                  _mtime, pool, run):
+        sync_directory(cn, options, files, _sublocal, subdir, pool=pool, _mtime=mtime, run=run)
+
+
+def _sync_listing(cn, options, files, _local: Path, _remote: str, _mtime: int,
+                  pool: TransferPool, run: 'SyncRun'):
+    """Sync the files of one remote directory
+
+    return:
+        (local, remote, mtime) of each subdirectory still to visit
+    """
+    logger.info(f'Syncing directory {_remote}')
+    triage = _Triage(options, _remote, run.cutoff, newest_first=not pool)
+    # read the whole listing first: submit blocks once the pool is full, and
+    # an idle data connection would be dropped by the server meanwhile
+    entries = cn.dir(sort=not pool, path=_remote)
+    for entry in triage.files(entries):
+        _sync_entry(cn, options, files, entry, _local, _remote, pool, run)
+    if cn.unparsed:
+        options.stats.incr('unparsed', len(cn.unparsed))
+        _fail_dir(options, _remote)
+    _record_dir(options, _remote, _mtime, triage.count, triage.dirs)
+    subdirs = []
+    for entry in triage.subdirs:
+        subdir = posixpath.join(_remote, entry.name)
+        if not _unchanged_dir(options, subdir, entry):
+            subdirs.append((_local / entry.name, subdir, entry.mtime))
+    return subdirs
+
+
+def sync_tree(cn, options, files, _local: Path = None, _remote: str = None,
+              pool: TransferPool = None, run: 'SyncRun' = None):
+    """Sync a remote FTP directory to a local directory from one flat listing
+
+    The tree is listed with `list_tree`, so no directory changes are needed.
+    A directory that matches `ignore_re` is skipped with everything below it.
+    """
+    if run is None:
+        with _sync_run(options) as run:
+            return sync_tree(cn, options, files, _local, _remote, pool, run)
+    _local = _local or options.localdir
+    _remote = _remote or options.remotedir
+    logger.info(f'Syncing tree {_remote}')
+    entries = cn.list_tree(_remote)
+    if cn.unparsed:
+        options.stats.incr('unparsed', len(cn.unparsed))
+    known = _known(options, _remote, tree=True)
+    cutoff = run.cutoff
+    skipped = {'': False}
+
+    def under_skipped(path):
+        if path not in skipped:
+            head, _, tail = path.rpartition('/')
+            skipped[path] = under_skipped(head) or _skip_dir(options, tail, cutoff, count=False)
+        return skipped[path]
+
+    entries = sort_entries(entries)
+    for i, entry in enumerate(entries):
+        parent, _, name = entry.name.rpartition('/')
+        if under_skipped(parent):
             continue
         if entry.is_dir:
-            sync_directory(cn, options, files, _local / entry.name,
-                           posixpath.join(_remote, entry.name))
+            _skip_dir(options, name, cutoff)
             continue
-        try:
-            filename = sync_file(cn, options, entry, _local, _remote)
-            if filename:
-                files.append(filename)
-        except:
-            logger.exception('Error syncing file: %s/%s', _remote, entry.name)
+        if options.ignore_re and re.match(options.ignore_re, name):
+            logger.debug(f'Ignoring file that matches ignore pattern: {entry.name}')
+            options.stats.incr('ignored')
+            continue
+        if cutoff is not None and entry.mtime < cutoff:
+            # newest first, so every file after this one is older still
+            expired = sum(not e.is_dir and not under_skipped(e.name.rpartition('/')[0])
+                          for e in entries[i:])
+            logger.debug(f'{expired} files older than the cutoff in {_remote}')
+            options.stats.incr('expired', expired)
+            break
+        if known and _unchanged(options, known, entry.name, entry, _remote):
+            continue
+        entry.name = name
+        _sync_entry(cn, options, files, entry, _local / parent,
+                    posixpath.join(_remote, parent) if parent else _remote, pool, run)
 
 
-def sync_file(cn, options, entry, _local: Path, _remote: str):
-    if options.ignoreolderthan and entry.datetime < DateTime.now().subtract(days=int(options.ignoreolderthan)):
+class _Triage:
+    """Sorts one directory listing into subdirectories to visit and files
+    to fetch, dropping ignored, expired and unchanged entries
+
+    With a newest-first listing, files stop being examined at the first one
+    older than the age cutoff.
+    """
+
+    def __init__(self, options, _remote: str, cutoff: int = None, newest_first=False):
+        self.options = options
+        self.remote = _remote
+        self.cutoff = cutoff
+        self.newest_first = newest_first
+        self.known = _known(options, _remote)
+        self.subdirs = []
+        self.count = 0
+        self.dirs = 0
+
+    def files(self, entries):
+        options, cutoff, expired = self.options, self.cutoff, False
+        for self.count, entry in enumerate(entries, 1):
+            if entry.is_dir:
+                self.dirs += 1
+                if not _skip_dir(options, entry.name, cutoff):
+                    self.subdirs.append(entry)
+                continue
+            if expired:
+                options.stats.incr('expired')
+                continue
+            if options.ignore_re and re.match(options.ignore_re, entry.name):
+                logger.debug(f'Ignoring file that matches ignore pattern: {entry.name}')
+                options.stats.incr('ignored')
+                continue
+            if cutoff is not None and entry.mtime < cutoff:
+                logger.debug('File is too old: %s/%s: (%s)', self.remote, entry.name, str(entry.datetime))
+                options.stats.incr('expired')
+                expired = self.newest_first
+                continue
+            if self.known and _unchanged(options, self.known, entry.name, entry, self.remote):
+                continue
+            yield entry
+
+
+DATED_DIR_RE = re.compile(r'^((?:19|20)\d{2})(?:[-_]?(\d{2})(?:[-_]?(\d{2}))?)?$')
+
+
+def dated_dir_end(name: str) -> int | None:
+    """End of the period a dated directory name covers (`2025`, `202501`,
+    `20250101`, `2025-01-01`) as an epoch, with a day's slack for time
+    zones; None for other names"""
+    if not (m := DATED_DIR_RE.match(name)):
+        return None
+    year, month, day = (int(g) if g else None for g in m.groups())
+    if month is not None and not 1 <= month <= 12:
+        return None
+    try:
+        if day:
+            end = datetime.date(year, month, day) + datetime.timedelta(days=1)
+        elif month:
+            end = datetime.date(year + month // 12, month % 12 + 1, 1)
+        else:
+            end = datetime.date(year + 1, 1, 1)
+    except ValueError:
+        return None
+    return calendar.timegm(end.timetuple()) + 86400
+
+
+def age_cutoff(options) -> int | None:
+    """Epoch before which files are ignored under `ignoreolderthan`"""
+    if options.ignoreolderthan:
+        return int(DateTime.now().subtract(days=int(options.ignoreolderthan)).timestamp())
+
+
+def _skip_dir(options, name: str, cutoff, count=True):
+    """Whether a directory is left out by `ignore_re` or, with
+    `skip_dated_dirs`, by a dated name ending before the cutoff"""
+    if options.ignore_re and re.match(options.ignore_re, name):
+        if count:
+            logger.debug(f'Ignoring file that matches ignore pattern: {name}')
+            options.stats.incr('ignored')
+        return True
+    if options.skip_dated_dirs and cutoff is not None and \
+            (end := dated_dir_end(name)) is not None and end < cutoff:
+        if count:
+            logger.debug(f'Dated directory is too old: {name}')
+            options.stats.incr('expired_dirs')
+        return True
+    return False
+
+
+def _known(options, _remote: str, tree=False) -> set:
+    """Files the manifest says were already fetched unchanged, as
+    (name, size, mtime); empty without a manifest or with `ignorelocal`"""
+    if options.ignorelocal or not (manifest := sync_manifest(options)):
+        return set()
+    if tree:
+        return manifest.known_tree(site_key(options), _remote)
+    return manifest.known(site_key(options), _remote)
+
+
+def _unchanged(options, known: set, name: str, entry, _remote: str):
+    if (name, entry.size, entry.mtime) not in known:
+        return False
+    logger.debug('File has not changed since the last sync: %s/%s', _remote, name)
+    options.stats.incr('skipped')
+    return True
+
+
+def _record(options, _remote: str, entry, local, decrypted=False, checksum=None):
+    if manifest := sync_manifest(options):
+        manifest.record(site_key(options), _remote, entry, local, decrypted, checksum)
+
+
+def _unchanged_dir(options, _remote: str, entry):
+    """Whether the directory at `_remote` can be skipped: its mtime matches
+    the last complete listing, that listing is recent enough, and it had no
+    subdirectories (an mtime only changes with its direct children, so a
+    new file deeper down would not show)"""
+    if not options.prune_dirs or not (manifest := sync_manifest(options)):
+        return False
+    record = manifest.directory(site_key(options), _remote)
+    if not record or record[0] != entry.mtime or record[3] != 0:
+        return False
+    if record[2] - record[0] < 60:
+        return False  # listed within the minute of a change, finer than LIST dates show
+    if options.force_full_scan is not None and \
+            time.time() - record[2] > options.force_full_scan * 86400:
+        return False
+    logger.debug('Directory has not changed since %d entries were listed: %s', record[1], _remote)
+    options.stats.incr('pruned')
+    return True
+
+
+def _record_dir(options, _remote: str, mtime, count, subdirs):
+    if mtime is not None and options.prune_dirs and (manifest := sync_manifest(options)):
+        manifest.record_dir(site_key(options), _remote, mtime, count, subdirs)
+
+
+def _fail_dir(options, _remote: str):
+    if options.prune_dirs and (manifest := sync_manifest(options)):
+        manifest.fail_dir(site_key(options), _remote)
+
+
+def _sync_entry(cn, options, files, entry, _local: Path, _remote: str,
+                pool: TransferPool = None, run: 'SyncRun' = None):
+    if pool:
+        pool.submit(entry, _local, _remote)
+        return
+    try:
+        filename = sync_file(cn, options, entry, _local, _remote, run)
+        if filename:
+            files.append(filename)
+    except:
+        logger.exception('Error syncing file: %s/%s', _remote, entry.name)
+        _fail_dir(options, _remote)
+
+
+def sync_file(cn, options, entry, _local: Path, _remote: str, run: 'SyncRun' = None):
+    if run is None:
+        with _sync_run(options) as run:
+            return sync_file(cn, options, entry, _local, _remote, run)
+    cutoff = run.cutoff
+    if cutoff is not None and entry.mtime < cutoff:
         logger.debug('File is too old: %s/%s: (%s)', _remote, entry.name, str(entry.datetime))
         return
     localfile = _local / entry.name
-    localpgpfile = (_local / '.pgp') / entry.name
-    if not options.ignorelocal and (localfile.exists() or localpgpfile.exists()):
-        st = localfile.stat() if localfile.exists() else localpgpfile.stat()
-        if entry.datetime <= DateTime.parse(st.st_mtime).replace(tzinfo=options.tzinfo):
-            if not options.ignoresize and (entry.size == st.st_size):
+    snapshot = run.snapshot
+    if not options.ignorelocal and (st := snapshot.stat(_local, entry.name)):
+        size, st_mtime = st
+        if entry.mtime <= _as_site_time(st_mtime, options.tzinfo):
+            if not options.ignoresize and (entry.size == size):
                 logger.debug('File has not changed: %s/%s', _remote, entry.name)
-                options.stats['skipped'] += 1
+                options.stats.incr('skipped')
+                _record(options, _remote, entry, localfile)
                 return
     logger.debug('Downloading file: %s/%s to %s', _remote, entry.name, localfile)
-    filename = None
-    with contextlib.suppress(Exception):
-        Path(os.path.split(localfile)[0]).mkdir(parents=True)
+    filename = checksum = None
+    snapshot.mkdir(_local)
+    encrypted = not options.nodecryptlocal and options.is_encrypted(localfile.as_posix())
+    if encrypted and options.stream_decrypt and not options.nocopy:
+        return stream_decrypt_file(cn, options, entry, _local, _remote, snapshot)
     if not options.nocopy:
-        cn.getbinary(entry.name, localfile)
         mtime = int(DateTime(*entry.datetime.timetuple()[:7]).epoch())
+        remotefile = posixpath.join(_remote, entry.name)
+        start = time.perf_counter()
+        nbytes = download_file(cn, options, entry, remotefile, localfile, mtime, snapshot)
+        options.stats.incr('download_seconds', time.perf_counter() - start)
+        options.stats.incr('bytes', nbytes or 0)
         try:
             os.utime(localfile, (mtime, mtime))
         except OSError:
             logger.warning(f'Could not touch new file time on {localfile}')
-        options.stats['copied'] += 1
+        options.stats.incr('copied')
         filename = localfile
-    if not options.nocopy and not options.nodecryptlocal and options.is_encrypted(localfile.as_posix()):
-        newname = options.rename_pgp(entry.name)
-        decrypt_pgp_file(options, entry.name, newname, _local)
-        # keep a copy for stat comparison above but move to .pgp dir so it doesn't clutter the main directory
-        with contextlib.suppress(Exception):
-            Path(os.path.split(localpgpfile)[0]).mkdir(parents=True)
-        shutil.move(localfile, localpgpfile)
-        options.stats['decrypted'] += 1
-        filename = _local / newname
+        if options.manifest and options.manifest_checksum:
+            checksum = file_checksum(localfile)
+    if not options.nocopy and encrypted:
+        if run.decrypter:
+            # the connection moves on while a gpg worker decrypts
+            run.decrypter.submit(entry, _local, _remote, checksum, snapshot)
+            return
+        return decrypt_download(options, entry, _local, _remote, checksum, snapshot)
+    if filename:
+        _record(options, _remote, entry, filename, False, checksum)
+    return filename
+
+
+def stream_decrypt_file(cn, options, entry, _local: Path, _remote: str,
+                        snapshot: 'LocalSnapshot' = None):
+    """Download an encrypted file straight into gpg
+
+    The plaintext and (with `keep_ciphertext`) the `.pgp` copy are written
+    under `.part` as the bytes arrive and moved into place once gpg is done.
+    Without the ciphertext copy, only a manifest can tell later runs that
+    the file was already fetched.
+    """
+    if snapshot is None:
+        snapshot = LocalSnapshot()
+        try:
+            return stream_decrypt_file(cn, options, entry, _local, _remote, snapshot)
+        finally:
+            snapshot.remove_partial_dirs()
+    remotefile = posixpath.join(_remote, entry.name)
+    newname = options.rename_pgp(entry.name)
+    partdir = _local / PARTIAL_DIR
+    snapshot.mkdir(partdir)
+    plainpart = partdir / newname
+    cipherpart = partdir / entry.name if options.keep_ciphertext else None
+    digest = hashlib.sha256() if options.manifest and options.manifest_checksum else None
+    start = time.perf_counter()
+    try:
+        # closing aborts the transfer at once if gpg or the write side fails
+        with contextlib.closing(cn.iter_bytes(remotefile)) as stream:
+            chunks = _hashing(stream, digest) if digest else stream
+            decrypted, nbytes = decrypt_pgp_stream(options, chunks, plainpart, cipherpart, entry.name)
+        if nbytes != entry.size:
+            raise OSError(f'Incomplete download of {remotefile}: {nbytes} != {entry.size}')
+    except:
+        for part in (plainpart, cipherpart):
+            if part:
+                part.unlink(missing_ok=True)
+        raise
+    elapsed = time.perf_counter() - start
+    options.stats.incr('download_seconds', elapsed)
+    options.stats.incr('decrypt_seconds', elapsed)
+    options.stats.incr('bytes', nbytes)
+    options.stats.incr('copied')
+    _log_transfer(remotefile, nbytes, elapsed)
+    checksum = digest.hexdigest() if digest else None
+    mtime = int(DateTime(*entry.datetime.timetuple()[:7]).epoch())
+    if cipherpart:
+        localpgpfile = (_local / '.pgp') / entry.name
+        snapshot.mkdir(localpgpfile.parent)
+        os.utime(cipherpart, (mtime, mtime))
+        os.replace(cipherpart, localpgpfile)
+    if not decrypted:
+        plainpart.unlink(missing_ok=True)
+        if cipherpart:
+            _record(options, _remote, entry, localpgpfile, False, checksum)
+        return
+    filename = _local / newname
+    os.replace(plainpart, filename)
+    options.stats.incr('decrypted')
+    _record(options, _remote, entry, filename, True, checksum)
+    return filename
+
+
+def _hashing(chunks, digest):
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def decrypt_download(options, entry, _local: Path, _remote: str, checksum=None,
+                     snapshot: 'LocalSnapshot' = None):
+    """Decrypt a downloaded file and move the ciphertext into `.pgp`"""
+    localfile = _local / entry.name
+    localpgpfile = (_local / '.pgp') / entry.name
+    newname = options.rename_pgp(entry.name)
+    start = time.perf_counter()
+    decrypt_pgp_file(options, entry.name, newname, _local)
+    options.stats.incr('decrypt_seconds', time.perf_counter() - start)
+    # keep a copy for stat comparison above but move to .pgp dir so it doesn't clutter the main directory
+    (snapshot or LocalSnapshot()).mkdir(localpgpfile.parent)
+    shutil.move(localfile, localpgpfile)
+    options.stats.incr('decrypted')
+    filename = _local / newname
+    _record(options, _remote, entry, filename, True, checksum)
     return filename
 
 
+class DecryptPool:
+    """Pipeline stage that runs gpg on completed downloads in worker threads
+
+    `submit` blocks once `backlog` files are waiting, so transfers cannot
+    fill the disk with ciphertext faster than it is decrypted. Results are
+    collected in submission order in `files`.
+    """
+
+    def __init__(self, options: FtpOptions, workers: int = 2, backlog: int = 8):
+        self.options = options
+        self.files = []
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='ftp-decrypt')
+
+    def submit(self, entry, _local: Path, _remote: str, checksum=None, snapshot=None):
+        start = time.perf_counter()
+        self._slots.acquire()
+        if (waited := time.perf_counter() - start) > 0.001:
+            self.options.stats.incr('decrypt_wait_seconds', waited)
+        try:
+            future = self._executor.submit(decrypt_download, self.options, entry, _local,
+                                           _remote, checksum, snapshot)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append((future, entry.name))
+
+    def join(self):
+        for future, name in self._futures:
+            try:
+                if filename := future.result():
+                    self.files.append(filename)
+            except:
+                logger.exception('Error decrypting file: %s', name)
+        self._futures = []
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.join()
+        finally:
+            self.close()
+
+
+class SyncRun:
+    """State of one sync run: the age cutoff, the local snapshot and the
+    decrypt pool, if any
+
+    Kept apart from FtpOptions, so runs sharing one options object do not
+    see or reset each other's state.
+    """
+
+    def __init__(self, options: FtpOptions, decrypter: 'DecryptPool' = None):
+        self.cutoff = age_cutoff(options)
+        self.snapshot = LocalSnapshot()
+        self.decrypter = decrypter
+
+
+@contextlib.contextmanager
+def _sync_run(options):
+    """A run for a direct call outside `sync_site`, cleaned up after"""
+    run = SyncRun(options)
+    try:
+        yield run
+    finally:
+        run.snapshot.remove_partial_dirs()
+
+
+class LocalSnapshot:
+    """One `os.scandir` per local target directory (and its `.pgp` sibling)
+    answering the exists/stat questions sync asks for every remote file,
+    plus memoized directory creation
+
+    A snapshot is taken per sync run; files written during the run are not
+    added, since each remote file is only looked up once.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self._made = set()
+        self._lock = threading.Lock()
+
+    def listing(self, path: Path) -> dict[str, os.DirEntry]:
+        """Return {name: DirEntry} for the regular files in `path`
+
+        The file type comes from the directory read itself on most systems;
+        a file is only stat'ed when a lookup asks for it.
+        """
+        with self._lock:
+            listing = self._dirs.get(path)
+        if listing is not None:
+            return listing
+        listing = {}
+        try:
+            with os.scandir(path) as it:
+                for item in it:
+                    if item.is_file():
+                        listing[item.name] = item
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        with self._lock:
+            return self._dirs.setdefault(path, listing)
+
+    def stat(self, _local: Path, name: str) -> tuple[int, float] | None:
+        """(size, mtime) of `name` in `_local`, else of its copy in `.pgp`"""
+        item = self.listing(_local).get(name) or self.listing(_local / '.pgp').get(name)
+        if item is None:
+            return
+        try:
+            st = item.stat()
+        except FileNotFoundError:
+            return
+        return st.st_size, st.st_mtime
+
+    def mkdir(self, path: Path):
+        if path in self._made:
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._made.add(path)
+
+    def remove_partial_dirs(self):
+        """Remove the `.part` directories used during the run once empty;
+        done at the end, as concurrent downloads may share one"""
+        with self._lock:
+            made = [path for path in self._made if path.name == PARTIAL_DIR]
+        for path in made:
+            with contextlib.suppress(OSError):
+                path.rmdir()
+
+
+def _as_site_time(st_mtime: float, tzinfo) -> float:
+    """A local file's mtime, read as wall-clock time in the site's zone
+    for comparison with remote times; unchanged for the local zone"""
+    if tzinfo is LCL:
+        return st_mtime
+    return DateTime.parse(st_mtime).replace(tzinfo=tzinfo).timestamp()
+
+
+PARTIAL_DIR = '.part'
+
+
+def download_file(cn, options, entry, remotefile: str, localfile: Path, mtime: int,
+                  snapshot: 'LocalSnapshot' = None):
+    """Download into a partial file and move it into place once complete
+
+    A sidecar next to the partial file records the remote size and mtime,
+    so an interrupted transfer resumes where it stopped as long as the
+    remote entry has not changed since. For segmented downloads the sidecar
+    also lists the ranges already complete, and only the others are fetched.
+    """
+    segmented = options.segment_threshold and entry.size >= options.segment_threshold
+    if not options.resume:
+        if segmented:
+            return cn.getsegmented(remotefile, localfile, entry.size, options.segments)
+        return cn.getbinary(remotefile, localfile)
+    if snapshot is None:
+        snapshot = LocalSnapshot()
+        try:
+            return download_file(cn, options, entry, remotefile, localfile, mtime, snapshot)
+        finally:
+            snapshot.remove_partial_dirs()
+    partfile = localfile.parent / PARTIAL_DIR / localfile.name
+    sidecar = partfile.with_name(f'{partfile.name}.json')
+    snapshot.mkdir(partfile.parent)
+    marker = {'remotefile': remotefile, 'size': entry.size, 'mtime': mtime}
+    if segmented:
+        marker['segments'] = options.segments
+    saved = _read_sidecar(sidecar) if partfile.exists() else None
+    if not saved or {k: v for k, v in saved.items() if k != 'done'} != marker:
+        saved = None
+        sidecar.write_text(json.dumps(marker))
+    if segmented:
+        done, lock = set(saved.get('done', ())) if saved else set(), threading.Lock()
+
+        def on_done(offset):
+            with lock:
+                done.add(offset)
+                sidecar.write_text(json.dumps({**marker, 'done': sorted(done)}))
+
+        if done:
+            logger.info('Resuming download of %s with %d of %d ranges complete',
+                        remotefile, len(done), options.segments)
+        nbytes = cn.getsegmented(remotefile, partfile, entry.size, options.segments,
+                                 frozenset(done), on_done)
+    else:
+        offset = partfile.stat().st_size if saved else 0
+        if offset > entry.size:
+            offset = 0
+        if offset:
+            logger.info('Resuming download of %s at byte %d of %d', remotefile, offset, entry.size)
+        if offset and offset == entry.size:
+            nbytes = 0  # complete, only the rename was interrupted
+        else:
+            nbytes = cn.getbinary(remotefile, partfile, offset=offset)
+    if (size := partfile.stat().st_size) != entry.size:
+        raise OSError(f'Incomplete download of {remotefile}: {size} != {entry.size}')
+    os.replace(partfile, localfile)
+    sidecar.unlink(missing_ok=True)
+    return nbytes
+
+
+def _read_sidecar(sidecar: Path):
+    try:
+        return json.loads(sidecar.read_text())
+    except (OSError, ValueError):
+        return None
+
+
 def as_posix(path):
     if not path:
         return path
     return str(path).replace(os.sep, '/')
 
 
+def _copy_chunks(src, dst, chunk_size):
+    nbytes = 0
+    while data := src.read(chunk_size):
+        dst.write(data)
+        nbytes += len(data)
+    return nbytes
+
+
+def _log_transfer(remotefile, nbytes, elapsed):
+    rate = nbytes / elapsed / 1e6 if elapsed else 0.0
+    logger.debug('Transferred %s: %d bytes in %.2fs (%.2f MB/s)',
+                 remotefile, nbytes, elapsed, rate)
+
+
 class BaseConnection(ABC):
 
+    # LIST lines the last listing could not parse
+    unparsed: list[str] = []
+
+    # per-site settings, by constructor keyword: (FtpOptions field, default);
+    # each is kept as `_<keyword>` and set by __init__, configure and spawn
+    SETTINGS: dict[str, tuple[str, object]] = {}
+
+    @classmethod
+    def settings_from(cls, options: FtpOptions) -> dict:
+        """The constructor keywords for a site's settings"""
+        return {name: getattr(options, field) for name, (field, _) in cls.SETTINGS.items()}
+
+    def _apply_settings(self, **settings):
+        if unknown := settings.keys() - self.SETTINGS.keys():
+            raise TypeError(f'Unexpected connection settings: {", ".join(sorted(unknown))}')
+        for name, (_, default) in self.SETTINGS.items():
+            setattr(self, f'_{name}', settings.get(name, default))
+
+    def _settings(self) -> dict:
+        return {name: getattr(self, f'_{name}') for name in self.SETTINGS}
+
+    def configure(self, options: FtpOptions):
+        """Apply a site's transfer settings to an open connection"""
+        self._apply_settings(**self.settings_from(options))
+
     @abstractmethod
     def pwd(self):
         pass
@@ -311,7 +1577,11 @@ class BaseConnection(ABC):
         pass
 
     @abstractmethod
-    def files(self):
+    def iterdir(self, path=None):
+        """Yield directory entries as the listing arrives"""
+
+    @abstractmethod
+    def files(self, path=None):
         pass
 
     @abstractmethod
@@ -319,15 +1589,15 @@ class BaseConnection(ABC):
         pass
 
     @abstractmethod
-    def getbinary(self, remotefile, localfile):
+    def getbinary(self, remotefile, localfile, offset=0):
         pass
 
     @abstractmethod
-    def putascii(self, localfile, remotefile):
+    def putascii(self, localfile, remotefile, recipients=None):
         pass
 
     @abstractmethod
-    def putbinary(self, localfile, remotefile):
+    def putbinary(self, localfile, remotefile, recipients=None):
         pass
 
     @abstractmethod
@@ -338,15 +1608,132 @@ class BaseConnection(ABC):
     def close(self):
         pass
 
+    def ping(self):
+        """Cheap liveness check used before reusing a pooled connection"""
+        try:
+            self.pwd()
+            return True
+        except Exception:
+            return False
+
+    @abstractmethod
+    def spawn(self):
+        """Open another connection to the same site for concurrent transfers"""
+
+    @abstractmethod
+    def getrange(self, remotefile, localfile, offset, length):
+        """Write `length` bytes of the remote file at `offset` into the
+        preallocated local file at the same offset"""
+
+    @abstractmethod
+    def iter_bytes(self, remotefile, chunk_size=None):
+        """Yield the remote file's contents in chunks without touching disk"""
+
+    def open_read(self, remotefile):
+        """Return a readable binary stream over the remote file"""
+        return io.BufferedReader(ChunkReader(self.iter_bytes(remotefile)))
+
+    def list_tree(self, path=None) -> list[Entry]:
+        """Return every entry below `path` (default: the current directory)
+        with names relative to it, listing one directory at a time"""
+        root = as_posix(path) or self.pwd()
+        entries, unparsed, pending = [], [], ['']
+        while pending:
+            rel = pending.pop()
+            for entry in self.iterdir(posixpath.join(root, rel) if rel else root):
+                if rel:
+                    entry.name = posixpath.join(rel, entry.name)
+                if entry.is_dir:
+                    pending.append(entry.name)
+                entries.append(entry)
+            unparsed.extend(self.unparsed)
+        self.unparsed = unparsed
+        return entries
+
+    def getsegmented(self, remotefile, localfile, size, segments=4, done=(), on_done=None):
+        """Get a large file in binary mode as concurrent byte ranges
+
+        Each range is fetched over a spawned connection and written straight
+        into a preallocated local file. Ranges whose offsets are in `done`
+        are already in `localfile` and are skipped; `on_done(offset)` is
+        called as each remaining range completes, so a caller can record
+        progress for a later resume. Returns the bytes transferred.
+        """
+        start = time.monotonic()
+        chunk = -(-size // segments)
+        ranges = [(offset, min(chunk, size - offset)) for offset in range(0, size, chunk)
+                  if offset not in done]
+        with Path(localfile).open('r+b' if done else 'wb') as f:
+            f.truncate(size)
+
+        def fetch(cn, offset, length):
+            nbytes = cn.getrange(remotefile, localfile, offset, length)
+            if nbytes == length and on_done:
+                on_done(offset)
+            return nbytes
+
+        workers = []
+        try:
+            for _ in ranges:
+                workers.append(self.spawn())
+            with ThreadPoolExecutor(max_workers=max(len(ranges), 1),
+                                    thread_name_prefix='ftp-segment') as executor:
+                counts = list(executor.map(lambda cn, r: fetch(cn, *r), workers, ranges))
+        finally:
+            for cn in workers:
+                cn.close()
+        for (offset, length), nbytes in zip(ranges, counts):
+            if nbytes != length:
+                raise OSError(f'short segment at {offset} in get!  {nbytes} != {length}')
+        nbytes = sum(length for _, length in ranges)
+        _log_transfer(remotefile, nbytes, time.monotonic() - start)
+        return nbytes
+
 
 class FtpConnection(BaseConnection):
     """Wrapper around ftplib
     """
-    def __init__(self, hostname, username, password, port=21, tzinfo=LCL):
+    SETTINGS = {
+        'tzinfo': ('tzinfo', LCL),
+        'blocksize': ('blocksize', 8192),
+        'mlsd': ('mlsd', True),
+        'recipients': ('pgp_recipients', ()),
+    }
+
+    def __init__(self, hostname, username, password, port=21, **settings):
+        self._apply_settings(**settings)
         self.ftp = ftplib.FTP()
         self.ftp.connect(hostname, port)
         self.ftp.login(username, password)
-        self._tzinfo = tzinfo
+        self._features = None
+        self._mlst_facts = False
+        self._list_recursive = True
+        self._rest = True
+        self._login = (hostname, username, password, port)
+
+    def spawn(self):
+        """Log in again; FTP allows one data transfer per control connection"""
+        cn = self.__class__(*self._login, **self._settings())
+        cn._features = self._features
+        cn._list_recursive = self._list_recursive
+        cn.cd(self.pwd())
+        return cn
+
+    @property
+    def features(self) -> set:
+        """Extensions advertised by the server in its FEAT response"""
+        if self._features is None:
+            try:
+                lines = self.ftp.sendcmd('FEAT').splitlines()[1:-1]
+                self._features = {line.strip().split(' ')[0].upper() for line in lines}
+            except ftplib.Error:
+                self._features = set()
+        return self._features
+
+    @property
+    def use_mlsd(self) -> bool:
+        """MLSD is implied by the MLST feature (RFC 3659)"""
+        return self._mlsd and 'MLST' in self.features
 
     def pwd(self):
         """Return the current directory"""
@@ -356,48 +1743,190 @@ class FtpConnection(BaseConnection):
         """Change the working directory"""
         return self.ftp.cwd(as_posix(path))
 
-    def dir(self, sort=False) -> list[Entry]:
-        """Return a directory listing as an array of lines"""
-        lines = []
-        self.ftp.dir(lines.append)
-        entries = []
-        for line in lines:
-            entry = parse_ftp_dir_entry(line, self._tzinfo)
-            if entry:
-                entries.append(entry)
+    def dir(self, sort=False, path=None) -> list[Entry]:
+        """Return a listing of `path` (default: the current directory)"""
+        entries = list(self.iterdir(path))
         if sort:
-            return sorted(entries, key=lambda x: x.datetime, reverse=True)
+            return sort_entries(entries)
         return entries
 
-    def files(self):
+    def iterdir(self, path=None):
+        """Yield directory entries as the listing arrives
+
+        Uses MLSD when the server supports it, for exact UTC modification
+        times, and falls back to parsing LIST output only when the server
+        reports MLSD as not implemented; errors for the path are raised.
+        """
+        self.unparsed = []
+        suffix = f' {as_posix(path)}' if path else ''
+        if self.use_mlsd:
+            if not self._mlst_facts:
+                self._mlst_facts = True
+                try:
+                    self.ftp.sendcmd(f'OPTS MLST {";".join(MLSD_FACTS)};')
+                except ftplib.error_perm as err:
+                    logger.debug(f'OPTS MLST refused, using the default facts: {err}')
+            try:
+                lines = iter_transfer_lines(self.ftp, f'MLSD{suffix}')
+                first = next(lines, None)
+            except ftplib.error_perm as err:
+                if not str(err).startswith(NOT_IMPLEMENTED):
+                    raise
+                logger.warning(f'MLSD failed, falling back to LIST: {err}')
+                self._mlsd = False
+            else:
+                if first is not None:
+                    for line in itertools.chain([first], lines):
+                        try:
+                            entry = parse_mlsd_line(line, self._tzinfo)
+                        except ValueError:
+                            self.unparsed.append(line)
+                            continue
+                        if entry:
+                            yield entry
+                if self.unparsed:
+                    logger.warning(f'{len(self.unparsed)} MLSD lines without a usable modify fact')
+                    logger.debug('\n'.join(self.unparsed))
+                return
+        lines = iter_transfer_lines(self.ftp, f'LIST{suffix}')
+        yield from iter_ftp_dir_listing(lines, self._tzinfo, self.unparsed)
+        if self.unparsed:
+            logger.warning(f'{len(self.unparsed)} LIST lines could not be parsed')
+            logger.debug('\n'.join(self.unparsed))
+
+    def list_tree(self, path=None) -> list[Entry]:
+        """Return every entry below `path` from a single `LIST -R`
+
+        Falls back to listing one directory at a time when the server
+        refuses or ignores -R.
+        """
+        if self._list_recursive:
+            root = as_posix(path) or self.pwd()
+            try:
+                lines = list(iter_transfer_lines(self.ftp, f'LIST -R {root}'))
+            except ftplib.error_perm as err:
+                logger.warning(f'LIST -R failed, walking directories instead: {err}')
+            else:
+                entries, unparsed = parse_ftp_tree_listing(lines, self._tzinfo, root)
+                if entries is not None:
+                    self.unparsed = unparsed
+                    return entries
+                logger.warning('LIST -R is not recursive on this server, walking directories instead')
+            self._list_recursive = False
+        return super().list_tree(path)
+
+    def files(self, path=None):
         """Return a bare filename listing as an array of strings"""
-        return self.ftp.nlst()
+        return self.ftp.nlst(*filter(None, [as_posix(path)]))
 
     def getascii(self, remotefile, localfile):
         """Get a file in ASCII (text) mode"""
         with Path(localfile).open('w') as f:
             self.ftp.retrlines(f'RETR {as_posix(remotefile)}', lambda line: f.write(f'{line}\n'))
 
-    def getbinary(self, remotefile, localfile):
-        """Get a file in binary mode"""
-        with Path(localfile).open('wb') as f:
-            self.ftp.retrbinary(f'RETR {as_posix(remotefile)}', f.write)
+    def getbinary(self, remotefile, localfile, offset=0):
+        """Get a file in binary mode, resuming at `offset` with REST
 
-    @streamtofile
-    def putascii(self, localfile, remotefile):
-        """Put a file in ASCII (text) mode"""
-        with Path(localfile).open('rb') as f:
+        A server that rejects REST gets the whole file again.
+        """
+        start, nbytes = time.monotonic(), 0
+        try:
+            with Path(localfile).open('r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                def write(data):
+                    nonlocal nbytes
+                    nbytes += len(data)
+                    f.write(data)
+                self.ftp.retrbinary(f'RETR {as_posix(remotefile)}', write, rest=offset or None)
+        except ftplib.error_perm as err:
+            if not offset or nbytes:
+                raise
+            logger.warning(f'Cannot resume {remotefile} at byte {offset} ({err}), starting over')
+            return self.getbinary(remotefile, localfile)
+        _log_transfer(remotefile, nbytes, time.monotonic() - start)
+        return nbytes
+
+    def getsegmented(self, remotefile, localfile, size, segments=4, done=(), on_done=None):
+        """Get a large file as concurrent byte ranges using REST
+
+        A server that rejects REST gets the file in a single stream, as do
+        later files on this connection.
+        """
+        if self._rest:
+            try:
+                return super().getsegmented(remotefile, localfile, size, segments, done, on_done)
+            except ftplib.error_perm as err:
+                logger.warning(f'Cannot fetch {remotefile} in ranges ({err}), using one stream')
+        nbytes = self.getbinary(remotefile, localfile)
+        self._rest = False
+        return nbytes
+
+    def getrange(self, remotefile, localfile, offset, length):
+        """Get a byte range in binary mode using REST"""
+        nbytes = 0
+        chunks = iter_transfer(self.ftp, f'RETR {as_posix(remotefile)}',
+                               self._blocksize, rest=offset)
+        with contextlib.closing(chunks), Path(localfile).open('r+b') as f:
+            f.seek(offset)
+            for data in chunks:
+                data = data[:length - nbytes]
+                f.write(data)
+                nbytes += len(data)
+                if nbytes >= length:
+                    break
+        return nbytes
+
+    def iter_bytes(self, remotefile, chunk_size=None):
+        """Yield the remote file in chunks as they arrive on the data connection
+
+        The control connection is busy until the iterator is exhausted or
+        closed.
+        """
+        return iter_transfer(self.ftp, f'RETR {as_posix(remotefile)}',
+                             chunk_size or self._blocksize)
+
+    def open_read(self, remotefile):
+        """Return a readable binary stream over the remote file"""
+        return io.BufferedReader(ChunkReader(self.iter_bytes(remotefile)), self._blocksize)
+
+    def putascii(self, localfile, remotefile, recipients=None):
+        """Put a file, file-like object or chunk iterable in ASCII (text) mode
+
+        Encrypted uploads are sent in binary mode, as ciphertext is binary.
+        """
+        if (self._recipients if recipients is None else recipients):
+            return self.putbinary(localfile, remotefile, recipients)
+        with upload_source(localfile, self._blocksize) as f:
+            if not hasattr(f, 'readline'):
+                f = io.BufferedReader(f, self._blocksize)
             self.ftp.storlines(f'STOR {as_posix(remotefile)}', f)
 
-    @streamtofile
-    def putbinary(self, localfile, remotefile):
-        """Put a file in binary mode"""
-        with Path(localfile).open('rb') as f:
-            self.ftp.storbinary(f'STOR {as_posix(remotefile)}', f, 1024)
+    def putbinary(self, localfile, remotefile, recipients=None):
+        """Put a file, file-like object or chunk iterable in binary mode
+
+        With `recipients` the data is piped through gpg and the ciphertext
+        is what gets stored; `None` uses the connection's `pgp_recipients`
+        and an empty list sends plaintext.
+        """
+        if recipients is None:
+            recipients = self._recipients
+        with encrypted_upload(self, remotefile, recipients) as opened, \
+                upload_source(localfile, self._blocksize) as f, \
+                encrypted_source(f, recipients, self._blocksize) as f:
+            opened[0] = True
+            self.ftp.storbinary(f'STOR {as_posix(remotefile)}', f, self._blocksize)
 
     def delete(self, remotefile):
         self.ftp.delete(as_posix(remotefile))
 
+    def ping(self):
+        try:
+            self.ftp.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
+
     def close(self):
         with contextlib.suppress(Exception):
             self.ftp.close()
@@ -446,9 +1975,21 @@ def _load_ssh_key(ssh_key_filename: str | Path | None = None,
 
 class SecureFtpConnection(BaseConnection):
 
-    def __init__(self, hostname, username, password=None, port=22, tzinfo=LCL,
+    SETTINGS = {
+        'tzinfo': ('tzinfo', LCL),
+        'prefetch': ('sftp_prefetch', True),
+        'request_size': ('sftp_request_size', 32768),
+        'max_requests': ('sftp_max_requests', None),
+        'pipeline_writes': ('sftp_pipeline_writes', True),
+        'max_writes': ('sftp_max_writes', 64),
+        'confirm': ('sftp_confirm', True),
+        'recipients': ('pgp_recipients', ()),
+    }
+
+    def __init__(self, hostname, username, password=None, port=22,
                  ssh_key_filename=None, ssh_key_content=None, ssh_key_type='rsa',
-                 ssh_key_passphrase=None):
+                 ssh_key_passphrase=None, **settings):
+        self._apply_settings(**settings)
 
         pkey = _load_ssh_key(ssh_key_filename, ssh_key_content, ssh_key_type, ssh_key_passphrase)
 
@@ -472,7 +2013,24 @@ class SecureFtpConnection(BaseConnection):
 
         self.ssh.connect(**connect_kwargs)
         self.ftp = self.ssh.open_sftp()
-        self._tzinfo = tzinfo
+        self._owns_transport = True
+        self._exec_find = True
+
+    def spawn(self):
+        """Open another SFTP channel over this connection's SSH transport
+
+        The new connection shares the login and handshake and starts in the
+        same directory. Closing it only closes its own channel.
+        """
+        cn = self.__class__.__new__(self.__class__)
+        cn._apply_settings(**self._settings())
+        cn.ssh = self.ssh
+        cn.ftp = self.ssh.open_sftp()
+        cn._owns_transport = False
+        cn._exec_find = self._exec_find
+        if cwd := self.ftp.getcwd():
+            cn.ftp.chdir(cwd)
+        return cn
 
     def pwd(self):
         """Return the current directory"""
@@ -482,50 +2040,166 @@ class SecureFtpConnection(BaseConnection):
         """Change the working directory"""
         return self.ftp.chdir(as_posix(path))
 
-    def dir(self, sort=False) -> list[Entry]:
-        """Return a directory listing as an array of lines"""
-        files = self.ftp.listdir_attr()  # paramiko.SFTPAttributes
-        entries = []
-        for f in files:
-            entry = Entry(f.longname,
-                          f.filename,
-                          stat.S_ISDIR(f.st_mode),
-                          f.st_size,
-                          DateTime.parse(f.st_mtime).replace(tzinfo=self._tzinfo))
-            entries.append(entry)
+    def dir(self, sort=False, path=None) -> list[Entry]:
+        """Return a listing of `path` (default: the current directory)"""
+        entries = list(self.iterdir(path))
         if sort:
-            return sorted(entries, key=lambda x: x.datetime, reverse=True)
+            return sort_entries(entries)
         return entries
 
-    def files(self):
+    def iterdir(self, path=None, read_aheads=50):
+        """Yield directory entries as READDIR responses arrive"""
+        keep_lines = logger.isEnabledFor(logging.DEBUG)
+        for f in self.ftp.listdir_iter(as_posix(path) or '.', read_aheads):
+            yield Entry(f.longname if keep_lines else None,
+                        f.filename,
+                        stat.S_ISDIR(f.st_mode),
+                        f.st_size,
+                        mtime=f.st_mtime,
+                        tzinfo=self._tzinfo)
+
+    def list_tree(self, path=None) -> list[Entry]:
+        """Return every entry below `path` from one remote `find`
+
+        Runs over the existing SSH transport when the server allows exec,
+        otherwise lists one directory at a time.
+        """
+        root = self.ftp.normalize(as_posix(path) or '.')
+        if self._exec_find:
+            cmd = f"find -H {shlex.quote(root)} -printf '%y %s %T@ %P\\0'"
+            try:
+                stdin, stdout, stderr = self.ssh.exec_command(cmd)
+                stdin.close()
+                data = stdout.read()
+                if status := stdout.channel.recv_exit_status():
+                    raise OSError(f'exit status {status}: {stderr.read().decode(errors="replace").strip()}')
+                self.unparsed = []
+                return parse_find_listing(data, self._tzinfo)
+            except (paramiko.SSHException, OSError, ValueError) as err:
+                logger.warning(f'Remote find failed, walking directories instead: {err}')
+                self._exec_find = False
+        return super().list_tree(root)
+
+    def files(self, path=None):
         """Return a bare filename listing as an array of strings"""
-        return self.ftp.listdir()
+        return self.ftp.listdir(as_posix(path) or '.')
 
     def getascii(self, remotefile, localfile):
         """Get a file in ASCII (text) mode"""
-        self.ftp.get(as_posix(remotefile), localfile)
-
-    def getbinary(self, remotefile, localfile):
-        """Get a file in binary mode"""
-        self.ftp.get(as_posix(remotefile), localfile)
-
-    @streamtofile
-    def putascii(self, localfile, remotefile):
-        """Put a file in ASCII (text) mode"""
-        self.ftp.put(localfile, as_posix(remotefile))
-
-    @streamtofile
-    def putbinary(self, localfile, remotefile):
-        """Put a file in binary mode"""
-        self.ftp.put(localfile, as_posix(remotefile))
+        return self.getbinary(remotefile, localfile)
+
+    def getbinary(self, remotefile, localfile, offset=0):
+        """Get a file in binary mode, resuming at `offset` with a seek
+
+        Reads are pipelined through paramiko's prefetch machinery using the
+        connection's request size and outstanding request window.
+        """
+        start = time.monotonic()
+        with self.ftp.open(as_posix(remotefile), 'rb') as fr:
+            size = fr.stat().st_size
+            fr.MAX_REQUEST_SIZE = self._request_size
+            fr.seek(offset)
+            if self._prefetch:
+                fr.prefetch(size, self._max_requests)
+            with Path(localfile).open('r+b' if offset else 'wb') as fl:
+                fl.seek(offset)
+                fl.truncate()
+                nbytes = _copy_chunks(fr, fl, self._request_size)
+        if offset + nbytes != size:
+            raise OSError(f'size mismatch in get!  {offset + nbytes} != {size}')
+        _log_transfer(remotefile, nbytes, time.monotonic() - start)
+        return nbytes
+
+    def iter_bytes(self, remotefile, chunk_size=None):
+        """Yield the remote file in chunks read through a prefetching SFTPFile"""
+        chunk_size = chunk_size or self._request_size
+        with self.open_read(remotefile) as f:
+            while data := f.read(chunk_size):
+                yield data
+
+    def open_read(self, remotefile):
+        """Return a readable binary SFTPFile with prefetching started"""
+        fr = self.ftp.open(as_posix(remotefile), 'rb')
+        fr.MAX_REQUEST_SIZE = self._request_size
+        if self._prefetch:
+            fr.prefetch(max_concurrent_requests=self._max_requests)
+        return fr
+
+    def getrange(self, remotefile, localfile, offset, length):
+        """Get a byte range in binary mode using offset reads"""
+        nbytes = 0
+        with self.ftp.open(as_posix(remotefile), 'rb') as fr, \
+                Path(localfile).open('r+b') as fl:
+            fr.MAX_REQUEST_SIZE = self._request_size
+            fr.seek(offset)
+            fl.seek(offset)
+            if self._prefetch:
+                # prefetch queues reads from the current offset up to the end given
+                fr.prefetch(offset + length, self._max_requests)
+            while nbytes < length:
+                data = fr.read(min(self._request_size, length - nbytes))
+                if not data:
+                    break
+                fl.write(data)
+                nbytes += len(data)
+        return nbytes
+
+    def putascii(self, localfile, remotefile, recipients=None):
+        """Put a file, file-like object or chunk iterable in ASCII (text) mode"""
+        return self.putbinary(localfile, remotefile, recipients)
+
+    def putbinary(self, localfile, remotefile, recipients=None):
+        """Put a file, file-like object or chunk iterable in binary mode
+
+        Writes are pipelined, waiting for the acknowledgements after every
+        `max_writes` requests so no more than that are in flight; the final size check is skipped unless `confirm`.
+        `recipients` encrypt the data on the way, as for
+        `FtpConnection.putbinary`.
+        """
+        if recipients is None:
+            recipients = self._recipients
+        start, nbytes = time.monotonic(), 0
+        with encrypted_upload(self, remotefile, recipients) as opened, \
+                upload_source(localfile, self._request_size) as fl, \
+                encrypted_source(fl, recipients, self._request_size) as fl, \
+                self.ftp.open(as_posix(remotefile), 'wb') as fr:
+            opened[0] = True
+            fr.MAX_REQUEST_SIZE = self._request_size
+            fr.set_pipelined(self._pipeline_writes)
+            for writes in itertools.count(1):
+                if not (data := fl.read(self._request_size)):
+                    break
+                # an unpipelined write waits for every pending acknowledgement
+                drain = self._pipeline_writes and self._max_writes and not writes % self._max_writes
+                if drain:
+                    fr.set_pipelined(False)
+                fr.write(data)
+                if drain:
+                    fr.set_pipelined(True)
+                nbytes += len(data)
+        if self._confirm and (size := self.ftp.stat(as_posix(remotefile)).st_size) != nbytes:
+            raise OSError(f'size mismatch in put!  {size} != {nbytes}')
+        _log_transfer(remotefile, nbytes, time.monotonic() - start)
+        return nbytes
 
     def delete(self, remotefile):
         self.ftp.remove(as_posix(remotefile))
 
+    def ping(self):
+        transport = self.ssh.get_transport()
+        if not transport or not transport.is_active():
+            return False
+        try:
+            self.ftp.stat('.')
+            return True
+        except Exception:
+            return False
+
     def close(self):
         with contextlib.suppress(Exception):
             self.ftp.close()
-            self.ssh.close()
+            if self._owns_transport:
+                self.ssh.close()
 
 
 class TlsFtpConnection:
@@ -589,10 +2263,8 @@ class TlsFtpConnection:
 
     def open(self, filename: str, mode: str = 'rb'):
         remote_filename = self._get_remote_path(filename)
-        file_bytes = BytesIO()
-        self.ftp_client.retrbinary(f'RETR {remote_filename}', file_bytes.write)
-        file_bytes.seek(0)
-        return file_bytes
+        chunks = iter_transfer(self.ftp_client, f'RETR {remote_filename}')
+        return io.BufferedReader(ChunkReader(chunks))
 
     def locate(self, attachment) -> str:
         return f'{self.base_url}/{attachment.path}'
@@ -0,0 +1,192 @@
+import atexit
+import contextlib
+import hashlib
+import logging
+import posixpath
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Manifest']
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    site TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    local TEXT,
+    decrypted INTEGER NOT NULL DEFAULT 0,
+    checksum TEXT,
+    synced REAL NOT NULL,
+    PRIMARY KEY (site, dir, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS directories (
+    site TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    scanned REAL NOT NULL,
+    subdirs INTEGER,
+    PRIMARY KEY (site, dir)
+) WITHOUT ROWID;
+"""
+
+
+class Manifest:
+    """SQLite record of the files previous syncs fetched
+
+    Keyed by site and remote path, it stores the remote size and mtime the
+    local copy was made from, so skip decisions for a whole directory come
+    from one query and a set lookup instead of a stat of every local file.
+    It also keeps each listed directory's mtime, entry count and number of
+    subdirectories, so leaf directories that have not changed need not be
+    listed again. Writes are buffered and may come from several worker
+    threads.
+    """
+
+    def __init__(self, path: str | Path, batch: int = 500):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(directories)')}
+        if 'subdirs' not in columns:  # manifests written before subdirs were counted
+            self._db.execute('ALTER TABLE directories ADD COLUMN subdirs INTEGER')
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._batch = batch
+        self._pending = []
+        self._dirs = {}
+        self._failed = set()
+
+    def known(self, site: str, remote_dir: str) -> set[tuple[str, int, int]]:
+        """Return the (name, size, mtime) recorded for one remote directory"""
+        self.flush()
+        with self._lock:
+            rows = self._db.execute('SELECT name, size, mtime FROM files '
+                                    'WHERE site = ? AND dir = ?',
+                                    (site, remote_dir)).fetchall()
+        return set(rows)
+
+    def known_tree(self, site: str, root: str) -> set[tuple[str, int, int]]:
+        """Return the (relative path, size, mtime) recorded below `root`"""
+        self.flush()
+        prefix = f'{root.rstrip("/")}/'
+        with self._lock:
+            rows = self._db.execute('SELECT dir, name, size, mtime FROM files '
+                                    'WHERE site = ? AND (dir = ? OR substr(dir, 1, ?) = ?)',
+                                    (site, root, len(prefix), prefix)).fetchall()
+        return {(name if parent == root else f'{parent[len(prefix):]}/{name}', size, mtime)
+                for parent, name, size, mtime in rows}
+
+    def record(self, site: str, remote_dir: str, entry, local=None, decrypted=False, checksum=None):
+        """Record that `entry` in `remote_dir` is now mirrored at `local`"""
+        row = (site, remote_dir, entry.name, entry.size, entry.mtime,
+               str(local) if local else None, int(decrypted), checksum, time.time())
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self._batch:
+                self._write()
+
+    def directory(self, site: str, remote_dir: str) -> tuple[int, int, float, int | None] | None:
+        """Return the (mtime, count, scanned, subdirs) recorded for a remote
+        directory; subdirs is None for records that predate it"""
+        with self._lock:
+            return self._db.execute('SELECT mtime, count, scanned, subdirs FROM directories '
+                                    'WHERE site = ? AND dir = ?',
+                                    (site, remote_dir)).fetchone()
+
+    def record_dir(self, site: str, remote_dir: str, mtime: int, count: int, subdirs: int):
+        """Note a fully listed directory; kept by `save_dirs` unless it or a
+        directory below it had a failure"""
+        with self._lock:
+            self._dirs[site, remote_dir] = (mtime, count, time.time(), subdirs)
+
+    def fail_dir(self, site: str, remote_dir: str):
+        with self._lock:
+            self._failed.add((site, remote_dir))
+
+    def save_dirs(self, site: str, discard=False):
+        """Write the directories noted for `site` since the last save
+
+        A directory is only written when nothing failed in its subtree, so
+        pruning never hides a file that still needs fetching.
+        """
+        with self._lock:
+            blocked = set()
+            for failed_site, path in self._failed:
+                while failed_site == site and path not in blocked:
+                    blocked.add(path)
+                    path = posixpath.dirname(path)
+            rows = [(site, path, *state) for (dir_site, path), state in self._dirs.items()
+                    if dir_site == site and path not in blocked]
+            self._dirs = {k: v for k, v in self._dirs.items() if k[0] != site}
+            self._failed = {k for k in self._failed if k[0] != site}
+            if discard or not rows:
+                return
+            self._db.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if not self._pending:
+            return
+        self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             self._pending)
+        self._db.commit()
+        self._pending = []
+
+    def close(self):
+        with self._lock:
+            self._write()
+            self._db.close()
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def sync_manifest(options):
+    """Resolve the `manifest` option (a path or a Manifest) to a Manifest, or None
+
+    Paths are opened once per process and shared by every sync using them.
+    """
+    if not options.manifest or isinstance(options.manifest, Manifest):
+        return options.manifest or None
+    path = Path(options.manifest).resolve()
+    with _manifests_lock:
+        if path not in _manifests:
+            _manifests[path] = Manifest(path)
+        return _manifests[path]
+
+
+def site_key(options) -> str:
+    return options.sitename or f'{options.hostname}:{options.port or ""}'
+
+
+def file_checksum(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open('rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@atexit.register
+def _close_manifests():
+    with _manifests_lock:
+        for manifest in _manifests.values():
+            with contextlib.suppress(Exception):
+                manifest.close()
+        _manifests.clear()
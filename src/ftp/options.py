@@ -1,4 +1,5 @@
 import os
+import threading
 from collections import defaultdict
 from dataclasses import dataclass, field
 from pathlib import Path
@@ -22,6 +23,18 @@ def rename_pgp():
     return wrapper
 
 
+class SyncStats(defaultdict):
+    """Counters that can be updated from several worker threads
+    """
+    def __init__(self, default_factory=int, *args, **kwargs):
+        super().__init__(default_factory, *args, **kwargs)
+        self._lock = threading.Lock()
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self[key] += n
+
+
 @dataclass
 class FtpOptions(ConfigOptions):
 
@@ -41,8 +54,25 @@ class FtpOptions(ConfigOptions):
     ssh_key_passphrase: str = None
     ssh_key_type: str = 'rsa'
 
+    # Transfer block size for FTP data connections and streamed uploads
+    blocksize: int = 8192
+
+    # Use MLSD listings when the FTP server advertises MLST
+    mlsd: bool = True
+
+    # SFTP read pipelining: request size and outstanding request window
+    sftp_prefetch: bool = True
+    sftp_request_size: int = 32768
+    sftp_max_requests: int | None = None
+
+    # SFTP upload pipelining: writes in flight and final size confirmation
+    sftp_pipeline_writes: bool = True
+    sftp_max_writes: int | None = 64
+    sftp_confirm: bool = True
+
     # Connection optional
     pgp_extension: str = None
+    pgp_recipients: list = field(default_factory=list)
     ignore_re: str = None
     is_encrypted: callable = field(default_factory=is_encrypted, repr=False)
     rename_pgp: callable = field(default_factory=rename_pgp, repr=False)
@@ -55,12 +85,37 @@ class FtpOptions(ConfigOptions):
     ignorelocal:bool = False
     ignoresize: bool = False
     ignoreolderthan: int | None = None
+    skip_dated_dirs: bool = False
     address: list = field(default_factory=list)
-    stats: defaultdict = field(init=False)
+    workers: int = 1
+    transfer_backlog: int = 256
+    multiplex: bool = False
+    segment_threshold: int | None = None
+    segments: int = 4
+    resume: bool = True
+    decrypt_workers: int = 0
+    decrypt_backlog: int = 8
+    stream_decrypt: bool = False
+    keep_ciphertext: bool = True
+    gpg_batch_size: int = 0
+    scan_workers: int = 4
+    prune_skipped_folders: bool = False
+    tree_listing: bool = False
+    listers: int = 1
+
+    # Connection reuse: True for the shared pool, or a ConnectionPool
+    pool: object = field(default=False, repr=False)
+
+    # Incremental sync state: a SQLite file path, or a Manifest
+    manifest: object = field(default=None, repr=False)
+    manifest_checksum: bool = False
+    prune_dirs: bool = False
+    force_full_scan: float | None = 7
+    stats: SyncStats = field(init=False)
     tzinfo = LCL
 
     def __post_init__(self):
-        self.stats = defaultdict(int)
+        self.stats = SyncStats(int)
         self.localdir = Path(self.localdir)
         self.remotedir = str(self.remotedir).replace(os.sep, '/')
 
@@ -71,5 +126,5 @@ __all__ = ['FtpOptions']
 if __name__ == '__main__':
     options = FtpOptions(hostname='127.0.0.1', username='foo', password='bar')
     print(options.rename_pgp('test.pgp'))
-    options.stats['test'] += 1
+    options.stats.incr('test')
     print(options.__dict__)
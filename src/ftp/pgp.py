@@ -4,6 +4,9 @@ import os
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 from opendate import Date, DateTime
@@ -13,7 +16,8 @@ from libb import load_options
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['decrypt_pgp_file', 'decrypt_all_pgp_files']
+__all__ = ['decrypt_pgp_file', 'decrypt_pgp_files', 'decrypt_pgp_stream', 'encrypt_pgp_stream',
+           'decrypt_all_pgp_files']
 
 
 def decrypt_pgp_file(options, pgpname: str, newname=None, _local: Path = None):
@@ -47,20 +51,219 @@ def decrypt_pgp_file(options, pgpname: str, newname=None, _local: Path = None):
                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                          text=True)
     out, err = p.communicate('password')
+    _log_gpg_errors(pgpname, err)
+
+
+def decrypt_pgp_files(options, jobs, batch_size=100, processes=1) -> list[bool]:
+    """Decrypt many files with a few gpg processes instead of one per file
+
+    `jobs` are (pgpname, newname, _local) as for `decrypt_pgp_file`. Each
+    batch is linked into a hidden scratch directory in `localdir` and
+    decrypted by one `gpg --decrypt-files`; its status output tells which
+    files succeeded, and failures log the same messages as one at a time.
+
+    return:
+        Per job, whether the plaintext was written
+    """
+    jobs = list(jobs)
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(processes, 1)) as executor:
+        results = executor.map(lambda batch: _decrypt_batch(options, batch), batches)
+        return [ok for batch in results for ok in batch]
+
+
+def _decrypt_batch(options, jobs) -> list[bool]:
+    # own directory per batch, so concurrent batches never share a parent to clean up
+    with tempfile.TemporaryDirectory(prefix='.pgp-', dir=options.localdir) as scratch:
+        scratch = Path(scratch)
+        names = []
+        for i, (pgpname, newname, _local) in enumerate(jobs):
+            if newname == pgpname:
+                raise ValueError(f'pgpname and newname cannot be the same: {pgpname}')
+            source = Path(_local or options.localdir) / pgpname
+            link = scratch / f'{i}.pgp'
+            try:
+                os.link(source, link)
+            except OSError:
+                os.symlink(source.resolve(), link)
+            names.append(link.name)
+        gpg_cmd = [gpg.exe, '--homedir', gpg.dir, '--batch', '--yes',
+                   '--passphrase-fd', '0', '--status-fd', '2']
+        if options.pgp_extension:
+            gpg_cmd += ['--load-extension', options.pgp_extension]
+        gpg_cmd += ['--decrypt-files', *names]
+        logger.debug(f'Decrypting {len(names)} files in one gpg process')
+        p = subprocess.run(gpg_cmd, input='password', capture_output=True, text=True, cwd=scratch)
+        status = _split_gpg_status(p.stderr)
+        results = []
+        for i, (pgpname, newname, _local) in enumerate(jobs):
+            lines = status.get(f'{i}.pgp', [])
+            output = scratch / str(i)
+            if '[GNUPG:] DECRYPTION_OKAY' in lines and output.exists():
+                shutil.move(output, Path(_local or options.localdir) / newname)
+                results.append(True)
+                continue
+            output.unlink(missing_ok=True)
+            err = '\n'.join(line.replace(f'{i}.pgp', pgpname) for line in lines
+                            if not line.startswith('[GNUPG:]'))
+            if not _log_gpg_errors(pgpname, err):
+                logger.error('Failed to decrypt %s\n%s:', pgpname, err)
+            results.append(False)
+        return results
+
+
+def _split_gpg_status(err: str) -> dict[str, list[str]]:
+    """Group gpg's interleaved messages and status lines by FILE_START"""
+    files, current = {}, None
+    for line in err.splitlines():
+        if line.startswith('[GNUPG:] FILE_START'):
+            current = files.setdefault(line.split(' ', 3)[-1], [])
+        elif current is not None:
+            current.append(line)
+    return files
+
+
+@contextlib.contextmanager
+def encrypt_pgp_stream(source, recipients, blocksize=65536):
+    """Yield a readable stream of `source` encrypted for `recipients`
+
+    `source` is a binary file object; a thread feeds it to `gpg --encrypt`
+    while the caller reads the ciphertext, so an upload can consume it
+    directly and no ciphertext is written to disk. Recipient keys must be
+    in `gpg.dir`; any key found there is used without a trust check
+    (`--trust-model always`), so import only verified keys. Raises OSError
+    if gpg fails; nothing is yielded until gpg has produced its first
+    output, so a rejected recipient fails before the caller opens the
+    remote file.
+    """
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    if not recipients:
+        raise ValueError('No recipients to encrypt for')
+    gpg_cmd = [gpg.exe, '--homedir', gpg.dir, '--batch', '--yes',
+               '--trust-model', 'always', '--encrypt']
+    for recipient in recipients:
+        gpg_cmd += ['--recipient', recipient]
+    logger.debug(' '.join(gpg_cmd))
+    failed = []
+
+    with tempfile.TemporaryFile() as errfile:
+        p = subprocess.Popen(gpg_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=errfile, bufsize=blocksize)
+
+        def feed():
+            try:
+                while data := source.read(blocksize):
+                    p.stdin.write(data)
+            except BrokenPipeError:
+                pass
+            except Exception as err:
+                failed.append(err)
+                p.kill()
+            finally:
+                with contextlib.suppress(BrokenPipeError):
+                    p.stdin.close()
+
+        feeder = threading.Thread(target=feed, name='gpg-encrypt', daemon=True)
+        feeder.start()
+        try:
+            if started := bool(p.stdout.peek(1)):
+                yield p.stdout
+        finally:
+            p.stdout.close()
+            feeder.join()
+            returncode = p.wait()
+        if failed:
+            raise failed[0]
+        if returncode or not started:
+            errfile.seek(0)
+            err = errfile.read().decode(errors='replace')
+            raise OSError(f'gpg failed to encrypt for {", ".join(recipients)}:\n{err}')
+
+
+def _log_gpg_errors(pgpname, err: str):
+    """Log known gpg failures; return True when there were any"""
+    failed = False
     if 'gpg: decryption failed: secret key not available' in err:
         logger.error('Failed to decrypt %s\n%s:', pgpname, err)
+        failed = True
     if 'decrypt_message failed: file open error' in err:
         logger.error('Failed to decrypt %s\n%s:', pgpname, err)
+        failed = True
+    return failed
+
+
+def decrypt_pgp_stream(options, chunks, plainfile: Path, cipherfile: Path = None,
+                       pgpname: str = None) -> tuple[bool, int]:
+    """Decrypt ciphertext chunks with GnuPG as they arrive
+
+    The chunks are fed to gpg's stdin, which writes `plainfile`, and are
+    also written to `cipherfile` when given, so no copy of the ciphertext
+    has to be read back from disk. The passphrase goes over its own pipe.
+
+    return:
+        Whether gpg succeeded, and the number of ciphertext bytes
+    """
+    pgpname = pgpname or Path(plainfile).name
+    logger.debug(f'Decrypting stream {pgpname} to {plainfile}')
+    gpg_cmd = [gpg.exe, '--homedir', gpg.dir, '--batch', '--yes']
+    if options.pgp_extension:
+        gpg_cmd += ['--load-extension', options.pgp_extension]
+    pass_fds = ()
+    if os.name == 'posix':
+        passfd, writefd = os.pipe()
+        os.write(writefd, b'password')
+        os.close(writefd)
+        gpg_cmd += ['--passphrase-fd', str(passfd)]
+        pass_fds = (passfd,)
+    else:
+        gpg_cmd += ['--passphrase', 'password']
+    gpg_cmd += ['--output', Path(plainfile).as_posix(), '--decrypt']
+    logger.debug(' '.join(gpg_cmd))
+    nbytes = 0
+    with tempfile.TemporaryFile() as errfile, \
+            (Path(cipherfile).open('wb') if cipherfile else contextlib.nullcontext()) as out:
+        try:
+            p = subprocess.Popen(gpg_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                 stderr=errfile, pass_fds=pass_fds)
+        finally:
+            for fd in pass_fds:
+                os.close(fd)
+        feeding = True
+        try:
+            for chunk in chunks:
+                nbytes += len(chunk)
+                if out:
+                    out.write(chunk)
+                if feeding:
+                    try:
+                        p.stdin.write(chunk)
+                    except BrokenPipeError:
+                        feeding = False  # gpg gave up; keep the ciphertext
+        finally:
+            with contextlib.suppress(BrokenPipeError):
+                p.stdin.close()
+            returncode = p.wait()
+        errfile.seek(0)
+        err = errfile.read().decode(errors='replace')
+    failed = _log_gpg_errors(pgpname, err)
+    if returncode and not failed:
+        logger.error('Failed to decrypt %s\n%s:', pgpname, err)
+    return not returncode, nbytes
 
 
 __THEYEAR = Date.today().year
+SKIP_FOLDER_RE = re.compile(r'(prev|legacy|old|archive|depr|pgp)', re.I)
+YEAR_FOLDER_RE = re.compile(r'^20\d{2}$')
 
 
 def skip_folder(path: Path):
     name = path.name
-    if re.search(r'(prev|legacy|old|archive|depr|pgp)', name, re.I):
+    if name == '.part':  # in-progress downloads
+        return True
+    if SKIP_FOLDER_RE.search(name):
         return True
-    date_match = re.match(r'^20\d{2}$', name)
+    date_match = YEAR_FOLDER_RE.match(name)
     if date_match:
         return int(date_match.group()) != __THEYEAR
     return False
@@ -85,30 +288,115 @@ def decrypt_all_pgp_files(options:FtpOptions = None, config=None, **kw):
     vendors.bar.ftp.username = 'baruser'
     vendors.bar.ftp.password = 'barpasswd'
     ...
+
+    Folders are listed by `scan_workers` threads. Files in folders matched
+    by `skip_folder` are left alone; with `prune_skipped_folders` the
+    folders below them are not scanned either. Files whose plaintext is
+    already there, non-empty and newer than the ciphertext are only archived.
+    Decryption overlaps the scan on up to `decrypt_workers` threads; with
+    `gpg_batch_size` set, files go through gpg in batches of that size.
     """
-    files = []
+    oldest = None
     if options.ignoreolderthan:
         oldest_date = DateTime.now().subtract(days=int(options.ignoreolderthan))
         logger.info(f'Skipping files created before {oldest_date})')
-    for _local, _, _files in os.walk(options.localdir):
-        _local = Path(_local)
-        if skip_folder(_local):
-            logger.debug(f'Skipping archive folder {_local}')
-            continue
-        logger.info(f'Decrypting files in folder {_local}: ({len(_files)} files)')
-        for name in _files:
-            localfile = _local / name
-            localpgpfile = (_local / '.pgp') / name
-            if options.ignoreolderthan:
-                created_on = DateTime.parse(localfile.stat().st_ctime)
-                if created_on < oldest_date:
+        oldest = oldest_date.timestamp()
+    futures, batch, current = [], [], 0
+    with ThreadPoolExecutor(max_workers=max(options.decrypt_workers, 1),
+                            thread_name_prefix='pgp-decrypt') as executor:
+        for _local, entries in _scan_folders(Path(options.localdir), options.scan_workers,
+                                             options.prune_skipped_folders):
+            logger.info(f'Decrypting files in folder {_local}: ({len(entries)} files)')
+            for job, stale in _pgp_jobs(options, _local, entries, oldest):
+                if not stale:
+                    _archive_pgp_files([job], [False])
+                    current += 1
+                    continue
+                batch.append(job)
+                if len(batch) >= (options.gpg_batch_size or 1):
+                    futures.append(executor.submit(_decrypt_and_archive, options, batch))
+                    batch = []
+        if batch:
+            futures.append(executor.submit(_decrypt_and_archive, options, batch))
+        files = [filename for future in futures for filename in future.result()]
+    if current:
+        logger.info(f'Archived {current} pgp files whose plaintext was already up to date')
+    return files
+
+
+def _scan_folders(root: Path, workers: int = 1, prune=False):
+    """Yield (folder, file entries) for `root` and each folder below it
+    that `skip_folder` allows, listing several folders at once
+
+    As with `os.walk`, folders below a skipped folder are still scanned
+    unless `prune`.
+    """
+    def scan(folder):
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError as err:
+            logger.warning(f'Could not list {folder}: {err}')
+            return folder, [], []
+        folders, files = [], []
+        for entry in entries:
+            if not entry.is_dir():
+                files.append(entry)
+            elif prune and skip_folder(entry):
+                logger.debug(f'Skipping archive folder {entry.path}')
+            elif not entry.is_symlink():
+                folders.append(Path(entry.path))
+        return folder, folders, files
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='pgp-scan') as executor:
+        pending = {executor.submit(scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder, folders, files = future.result()
+                pending |= {executor.submit(scan, sub) for sub in folders}
+                if skip_folder(folder):
+                    logger.debug(f'Skipping archive folder {folder}')
                     continue
-            if options.is_encrypted(name):
-                newname = options.rename_pgp(name)
-                decrypt_pgp_file(options, name, newname, _local)
-                with contextlib.suppress(Exception):
-                    Path(os.path.split(localpgpfile)[0]).mkdir(parents=True)
-                shutil.move(localfile, localpgpfile)
-                filename = _local / newname
-                files.append(filename)
+                yield folder, files
+
+
+def _pgp_jobs(options, _local: Path, entries, oldest: float | None):
+    """Yield ((pgpname, newname, _local), stale) for the encrypted files in
+    one folder; stale is False when the plaintext is already up to date"""
+    for entry in entries:
+        if not options.is_encrypted(entry.name):
+            continue
+        st = entry.stat()
+        if oldest and st.st_ctime < oldest:
+            continue
+        newname = options.rename_pgp(entry.name)
+        try:
+            plain = (_local / newname).stat()
+            stale = not plain.st_size or plain.st_mtime < st.st_mtime
+        except FileNotFoundError:
+            stale = True
+        yield (entry.name, newname, _local), stale
+
+
+def _decrypt_and_archive(options, jobs) -> list[Path]:
+    if options.gpg_batch_size:
+        decrypted = decrypt_pgp_files(options, jobs, batch_size=len(jobs))
+    else:
+        for job in jobs:
+            decrypt_pgp_file(options, *job)
+        decrypted = [True] * len(jobs)
+    return _archive_pgp_files(jobs, decrypted)
+
+
+def _archive_pgp_files(jobs, decrypted) -> list[Path]:
+    """Move each ciphertext into its folder's `.pgp` directory and return
+    the plaintext of those that were decrypted"""
+    files = []
+    for (name, newname, _local), ok in zip(jobs, decrypted):
+        localpgpfile = (_local / '.pgp') / name
+        localpgpfile.parent.mkdir(exist_ok=True)
+        shutil.move(_local / name, localpgpfile)
+        if ok:
+            files.append(_local / newname)
     return files
@@ -14,13 +14,16 @@ logger = logging.getLogger(__name__)
 
 
 def remove_files(path: str) -> None:
-    """Remove all files from a directory.
+    """Remove all files and subdirectories from a directory.
 
     Parameters
         path: Directory path to clean
     """
     for file in os.scandir(path):
-        pathlib.Path(file.path).unlink()
+        if file.is_dir(follow_symlinks=False):
+            shutil.rmtree(file.path)
+        else:
+            pathlib.Path(file.path).unlink()
 
 
 @pytest.fixture
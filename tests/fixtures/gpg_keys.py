@@ -0,0 +1,34 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import types
+
+import pytest
+
+import ftp.pgp
+
+
+@pytest.fixture
+def gpg_keyring(monkeypatch):
+    """Throwaway GnuPG home with one unprotected key pair.
+
+    Short-lived keyrings live directly under the temp directory, as the
+    gpg-agent socket path must stay short.
+
+    Returns
+        The key's user id, usable as a recipient
+    """
+    exe = shutil.which('gpg')
+    if not exe:
+        pytest.skip('gpg is not installed')
+    home = tempfile.mkdtemp(prefix='gpg-')
+    os.symlink(exe, os.path.join(home, 'gpg'))
+    recipient = 'sync-test@example.com'
+    subprocess.run([exe, '--homedir', home, '--batch', '--passphrase', '',
+                    '--quick-gen-key', recipient, 'future-default', 'default', 'never'],
+                   check=True, capture_output=True)
+    monkeypatch.setattr(ftp.pgp, 'gpg', types.SimpleNamespace(dir=home, exe=os.path.join(home, 'gpg')))
+    yield recipient
+    subprocess.run(['gpgconf', '--homedir', home, '--kill', 'gpg-agent'], capture_output=True)
+    shutil.rmtree(home, ignore_errors=True)
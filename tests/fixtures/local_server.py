@@ -0,0 +1,42 @@
+import pathlib
+import threading
+
+import pytest
+
+import ftp
+
+
+@pytest.fixture
+def local_ftp(tmp_path):
+    """In-process FTP server over a temporary directory.
+
+    For tests that arrange the remote tree directly (subdirectories, file
+    and directory mtimes), which the docker containers do not expose.
+
+    Returns
+        (options, root): a factory for FtpOptions that sync from the server
+        into a separate local directory, and the served directory
+    """
+    authorizers = pytest.importorskip('pyftpdlib.authorizers')
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    servers = pytest.importorskip('pyftpdlib.servers')
+
+    root = tmp_path / 'remote'
+    root.mkdir()
+    authorizer = authorizers.DummyAuthorizer()
+    authorizer.add_user('foo', 'bar', str(root), perm='elradfmwMT')
+    handler = type('Handler', (handlers.FTPHandler,), {'authorizer': authorizer})
+    server = servers.ThreadedFTPServer(('127.0.0.1', 0), handler)
+    port = server.socket.getsockname()[1]
+    thread = threading.Thread(target=server.serve_forever, kwargs={'timeout': 0.1}, daemon=True)
+    thread.start()
+
+    def options(**kw):
+        kw = {'localdir': tmp_path / 'local', 'remotedir': '/', **kw}
+        pathlib.Path(kw['localdir']).mkdir(exist_ok=True)
+        return ftp.FtpOptions(hostname='127.0.0.1', port=port, username='foo',
+                              password='bar', **kw)
+
+    yield options, root
+    server.close_all()
+    thread.join(5)
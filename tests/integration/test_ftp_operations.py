@@ -1,5 +1,12 @@
+import concurrent.futures
 import contextlib
+import ftplib
+import io
+import logging
 import os
+import struct
+import threading
+import time
 
 import pytest
 from src.ftp.client import sync_site
@@ -48,6 +55,92 @@ def test_ftp_dir(clean_ftp_mount, ftp_docker):
         assert 'RemoteFile2.txt' in file_names
 
 
+def test_ftp_dir_mlsd_matches_list(clean_ftp_mount, ftp_docker):
+    """Verify MLSD (when advertised) and LIST listings agree on names and sizes."""
+    localfile = create_local_file('MlsdFile.txt')
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putbinary(localfile, 'MlsdFile.txt')
+        assert isinstance(ftpcn.features, set)
+        listed = {(e.name, e.size) for e in ftpcn.dir()}
+        ftpcn._mlsd = False
+        assert listed == {(e.name, e.size) for e in ftpcn.dir()}
+
+
+def test_ftp_mlsd_options_sent_once(local_ftp, monkeypatch):
+    """Verify MLST facts are selected once per connection, and an empty
+    MLSD listing does not fall back to LIST."""
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    sent = []
+    ftp_OPTS = handlers.FTPHandler.ftp_OPTS
+    ftp_LIST = handlers.FTPHandler.ftp_LIST
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_OPTS',
+                        lambda self, line: sent.append(line) or ftp_OPTS(self, line))
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_LIST',
+                        lambda self, path: sent.append('LIST') or ftp_LIST(self, path))
+    options, root = local_ftp
+    (root / 'empty').mkdir()
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'file.txt').write_text('file')
+    with ftp.connectmanager(options()) as ftpcn:
+        assert ftpcn.use_mlsd
+        assert [e.name for e in ftpcn.iterdir('/sub')] == ['file.txt']
+        assert list(ftpcn.iterdir('/empty')) == []
+        assert ftpcn._mlsd
+    assert sent == ['MLST type;size;modify;']
+
+
+def test_ftp_mlsd_kept_after_path_error(local_ftp, monkeypatch):
+    """Verify a missing directory or a refused OPTS MLST does not switch the
+    connection to LIST for good."""
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_OPTS',
+                        lambda self, line: self.respond('501 Invalid argument.'))
+    options, root = local_ftp
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'file.txt').write_text('file')
+    with ftp.connectmanager(options()) as ftpcn:
+        with pytest.raises(ftplib.error_perm):
+            list(ftpcn.iterdir('/missing'))
+        assert [e.name for e in ftpcn.iterdir('/sub')] == ['file.txt']
+        assert ftpcn._mlsd
+
+
+def test_ftp_mlsd_not_implemented_falls_back(local_ftp, monkeypatch):
+    """Verify a server without MLSD is listed with LIST."""
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_MLSD',
+                        lambda self, path: self.respond('502 Command not implemented.'))
+    options, root = local_ftp
+    (root / 'file.txt').write_text('file')
+    with ftp.connectmanager(options()) as ftpcn:
+        assert [e.name for e in ftpcn.iterdir('/')] == ['file.txt']
+        assert not ftpcn._mlsd
+
+
+def test_ftp_list_by_path(clean_ftp_mount, ftp_docker):
+    """Verify listings by absolute path match listings of the working directory."""
+    localfile = create_local_file('PathFile.txt')
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putbinary(localfile, '/PathFile.txt')
+        cwd = ftpcn.pwd()
+        assert 'PathFile.txt' in ftpcn.files('/')
+        assert {e.name for e in ftpcn.dir(path='/')} == {e.name for e in ftpcn.dir()}
+        assert ftpcn.pwd() == cwd
+
+
+def test_ftp_iterdir_abandoned(clean_ftp_mount, ftp_docker):
+    """Verify an abandoned iterdir leaves the control connection usable."""
+    for i in range(3):
+        ftp_name = f'IterFile{i}.txt'
+        with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+            ftpcn.putbinary(create_local_file(ftp_name), ftp_name)
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        entries = ftpcn.iterdir()
+        assert next(entries).name.startswith('IterFile')
+        entries.close()
+        assert {e.name for e in ftpcn.iterdir()} >= {'IterFile0.txt', 'IterFile2.txt'}
+
+
 def test_ftp_put_ascii(clean_ftp_mount, ftp_docker):
     """Verify FTP ASCII file upload and download maintains content integrity."""
     localfile = os.path.join(config.tmpdir.dir, 'Local.txt')
@@ -112,6 +205,48 @@ def test_ftp_get_binary(clean_ftp_mount, ftp_docker):
         assert pathlib.Path(localfile).open('rb').read() == pathlib.Path(remotefile).open('rb').read()
 
 
+def test_ftp_get_segmented(clean_ftp_mount, ftp_docker):
+    """Verify segmented FTP download reassembles the file using REST."""
+    localfile = os.path.join(config.tmpdir.dir, 'Segmented.dat')
+    make_binary_file(localfile, 100000)
+    size = os.path.getsize(localfile)
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putbinary(localfile, 'Segmented.dat')
+        remotefile = os.path.join(config.tmpdir.dir, 'SegmentedCopy.dat')
+        assert ftpcn.getsegmented('Segmented.dat', remotefile, size, segments=3) == size
+        assert pathlib.Path(localfile).open('rb').read() == pathlib.Path(remotefile).open('rb').read()
+
+
+def test_ftp_put_streams(clean_ftp_mount, ftp_docker):
+    """Verify FTP uploads stream from file-like objects and chunk iterables."""
+    data = b''.join(struct.pack('i', i) for i in range(1000))
+    text = ''.join(f'Line {i}\n' for i in range(10))
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putbinary(io.BytesIO(data), 'Stream.dat')
+        ftpcn.putbinary((data[i:i + 100] for i in range(0, len(data), 100)), 'Chunks.dat')
+        ftpcn.putascii(io.StringIO(text), 'Stream.txt')
+        for name in ('Stream.dat', 'Chunks.dat'):
+            remotefile = os.path.join(config.tmpdir.dir, name)
+            ftpcn.getbinary(name, remotefile)
+            assert pathlib.Path(remotefile).open('rb').read() == data
+        remotefile = os.path.join(config.tmpdir.dir, 'Stream.txt')
+        ftpcn.getascii('Stream.txt', remotefile)
+        assert pathlib.Path(remotefile).open().read() == text
+
+
+def test_ftp_iter_bytes(clean_ftp_mount, ftp_docker):
+    """Verify FTP streaming reads and that an abandoned read leaves the session usable."""
+    localfile = os.path.join(config.tmpdir.dir, 'Stream.dat')
+    make_binary_file(localfile, 10000)
+    data = pathlib.Path(localfile).open('rb').read()
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putbinary(localfile, 'Stream.dat')
+        assert b''.join(ftpcn.iter_bytes('Stream.dat', 1000)) == data
+        with ftpcn.open_read('Stream.dat') as f:
+            assert f.read(10) == data[:10]
+        assert 'Stream.dat' in ftpcn.files()
+
+
 def test_ftp_delete(clean_ftp_mount, ftp_docker):
     """Verify FTP file deletion removes files from server."""
     localfile = os.path.join(config.tmpdir.dir, 'ToDelete.txt')
@@ -149,6 +284,363 @@ def test_sync_site(clean_ftp_mount, ftp_docker):
         assert len(lines) == 10
 
 
+def test_sync_site_workers(clean_ftp_mount, ftp_docker):
+    """Verify FTP site synchronization with parallel worker connections."""
+    names = [f'workerfile{i}.txt' for i in range(10)]
+    localfiles = [create_local_file(name) for name in names]
+
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        for localfile, name in zip(localfiles, names):
+            ftpcn.putascii(localfile, name)
+
+    for localfile in localfiles:
+        pathlib.Path(localfile).unlink()
+
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.workers = 4
+    files = sync_site(options)
+
+    assert sorted(pathlib.Path(f).name for f in files) == sorted(names)
+    for localfile in localfiles:
+        assert pathlib.Path(localfile).exists()
+
+
+def test_sync_site_tree_listing(clean_ftp_mount, ftp_docker):
+    """Verify FTP site synchronization from a single recursive listing."""
+    names = [f'treefile{i}.txt' for i in range(5)]
+    localfiles = [create_local_file(name) for name in names]
+
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        for localfile, name in zip(localfiles, names):
+            ftpcn.putascii(localfile, name)
+        assert sorted(e.name for e in ftpcn.list_tree() if not e.is_dir) == sorted(names)
+
+    for localfile in localfiles:
+        pathlib.Path(localfile).unlink()
+
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.tree_listing = True
+    files = sync_site(options)
+
+    assert sorted(pathlib.Path(f).name for f in files) == sorted(names)
+
+
+def test_sync_site_listers(clean_ftp_mount, ftp_docker):
+    """Verify FTP site synchronization with a concurrent breadth-first crawl."""
+    names = [f'crawlfile{i}.txt' for i in range(5)]
+    localfiles = [create_local_file(name) for name in names]
+
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        for localfile, name in zip(localfiles, names):
+            ftpcn.putascii(localfile, name)
+
+    for localfile in localfiles:
+        pathlib.Path(localfile).unlink()
+
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.listers = 3
+    options.workers = 2
+    files = sync_site(options)
+
+    assert sorted(pathlib.Path(f).name for f in files) == sorted(names)
+
+
+def test_sync_site_manifest(clean_ftp_mount, ftp_docker):
+    """Verify a sync manifest skips previously fetched files without local stats."""
+    localfile = create_local_file('manifestfile.txt')
+    with ftp.connectmanager('vendor.FOO.ftp', config) as ftpcn:
+        ftpcn.putascii(localfile, 'manifestfile.txt')
+    pathlib.Path(localfile).unlink()
+
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.manifest = ftp.Manifest(os.path.join(config.tmpdir.dir, 'manifest.db'))
+    try:
+        files = sync_site(options)
+        assert [pathlib.Path(f).name for f in files] == ['manifestfile.txt']
+
+        # the record, not the local file, decides the next run
+        pathlib.Path(localfile).unlink()
+        assert sync_site(options) == []
+        assert not pathlib.Path(localfile).exists()
+
+        options.ignorelocal = True
+        assert len(sync_site(options)) == 1
+    finally:
+        options.manifest.close()
+        pathlib.Path(options.manifest.path).unlink()
+
+
+@pytest.mark.parametrize('listers', [1, 2])
+def test_sync_site_prune_dirs(local_ftp, tmp_path, listers):
+    """Verify only unchanged leaf directories are pruned, so new files deeper
+    down are still found, walking recursively or with the crawler."""
+    options, root = local_ftp
+    (root / 'a' / 'b').mkdir(parents=True)
+    (root / 'a' / 'top.txt').write_text('top')
+    (root / 'a' / 'b' / 'old.txt').write_text('old')
+    hour_ago = time.time() - 3600
+    for path in (root / 'a' / 'b' / 'old.txt', root / 'a' / 'top.txt', root / 'a' / 'b', root / 'a'):
+        os.utime(path, (hour_ago, hour_ago))
+
+    manifest = ftp.Manifest(tmp_path / 'manifest.db')
+    try:
+        first = options(manifest=manifest, prune_dirs=True, listers=listers)
+        assert sorted(pathlib.Path(f).name for f in sync_site(first)) == ['old.txt', 'top.txt']
+
+        second = options(manifest=manifest, prune_dirs=True, listers=listers)
+        assert sync_site(second) == []
+        assert second.stats['pruned'] == 1  # a/b; a has a subdirectory
+
+        # a's mtime is unchanged, but it is listed and its changed child too
+        (root / 'a' / 'b' / 'new.txt').write_text('new')
+        third = options(manifest=manifest, prune_dirs=True, listers=listers)
+        assert [pathlib.Path(f).name for f in sync_site(third)] == ['new.txt']
+    finally:
+        manifest.close()
+
+
+def test_sync_site_resume_leaves_no_partial_dir(local_ftp):
+    """Verify the .part directory used for resumable downloads is removed."""
+    options, root = local_ftp
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'resume.txt').write_text('resume')
+    opts = options(workers=2)
+    files = sync_site(opts)
+    assert [pathlib.Path(f).name for f in files] == ['resume.txt']
+    assert not list(opts.localdir.rglob('.part'))
+
+
+def test_sync_site_transfer_backlog(local_ftp):
+    """Verify a small transfer backlog still syncs every file."""
+    options, root = local_ftp
+    names = [f'file{i:02d}.txt' for i in range(20)]
+    for name in names:
+        (root / name).write_text(name)
+    files = sync_site(options(workers=2, transfer_backlog=1))
+    assert sorted(pathlib.Path(f).name for f in files) == names
+
+
+def test_sync_site_workers_report_every_file(local_ftp, monkeypatch):
+    """Verify join() waits until each finished transfer's result is recorded."""
+    result = concurrent.futures.Future.result
+
+    def slow_result(self, timeout=None):
+        value = result(self, timeout)
+        time.sleep(0.2)
+        return value
+
+    monkeypatch.setattr(concurrent.futures.Future, 'result', slow_result)
+    options, root = local_ftp
+    names = [f'file{i}.txt' for i in range(5)]
+    for name in names:
+        (root / name).write_text(name)
+    files = sync_site(options(workers=3))
+    assert sorted(pathlib.Path(f).name for f in files) == names
+
+
+@pytest.mark.parametrize('listers', [1, 2])
+def test_sync_site_listing_read_before_submit(local_ftp, monkeypatch, listers):
+    """Verify no listing is left open while a file waits for a transfer slot."""
+    options, root = local_ftp
+    (root / 'sub').mkdir()
+    for name in ('a.txt', 'b.txt', 'sub/c.txt'):
+        (root / name).write_text(name)
+    iterdir, submit = ftp.client.FtpConnection.iterdir, ftp.client.TransferPool.submit
+    listing, open_at_submit = threading.local(), []
+
+    def tracking_iterdir(self, path=None):
+        listing.open = True
+        try:
+            yield from iterdir(self, path)
+        finally:
+            listing.open = False
+
+    def tracking_submit(self, *args):
+        open_at_submit.append(getattr(listing, 'open', False))
+        return submit(self, *args)
+
+    monkeypatch.setattr(ftp.client.FtpConnection, 'iterdir', tracking_iterdir)
+    monkeypatch.setattr(ftp.client.TransferPool, 'submit', tracking_submit)
+    files = ftp.sync_site(options(workers=2, listers=listers))
+    assert len(files) == 3
+    assert open_at_submit == [False] * 3
+
+
+def test_sync_site_stream_decrypt_needs_manifest(local_ftp, caplog):
+    """Verify dropping the ciphertext without a manifest is warned about."""
+    options, root = local_ftp
+    with caplog.at_level(logging.WARNING):
+        sync_site(options(stream_decrypt=True, keep_ciphertext=False))
+    assert 'needs a manifest' in caplog.text
+
+
+def test_sync_site_run_state_not_shared(local_ftp):
+    """Verify a reused FtpOptions does not answer later calls from the last
+    run's local snapshot."""
+    options, root = local_ftp
+    (root / 'a.txt').write_text('a')
+    opts = options(ignoreolderthan=1)
+    sync_site(opts)
+    (opts.localdir / 'a.txt').unlink()
+    with ftp.connectmanager(opts) as ftpcn:
+        entry = next(e for e in ftpcn.iterdir('/') if e.name == 'a.txt')
+        assert ftp.client.sync_file(ftpcn, opts, entry, opts.localdir, '/') == opts.localdir / 'a.txt'
+    assert (opts.localdir / 'a.txt').read_text() == 'a'
+    assert not (opts.localdir / '.part').exists()
+
+
+def test_sync_site_resume_segmented(local_ftp, monkeypatch):
+    """Verify an interrupted segmented download only fetches the missing ranges."""
+    options, root = local_ftp
+    data = bytes(range(256)) * 64
+    (root / 'large.bin').write_bytes(data)
+    getrange = ftp.client.FtpConnection.getrange
+    fetched = []
+
+    def failing(self, remotefile, localfile, offset, length):
+        if offset == 4096:
+            raise OSError('connection dropped')
+        return getrange(self, remotefile, localfile, offset, length)
+
+    def counting(self, remotefile, localfile, offset, length):
+        fetched.append(offset)
+        return getrange(self, remotefile, localfile, offset, length)
+
+    opts = options(segment_threshold=1024, segments=4)
+    monkeypatch.setattr(ftp.client.FtpConnection, 'getrange', failing)
+    assert ftp.sync_site(opts) == []
+    monkeypatch.setattr(ftp.client.FtpConnection, 'getrange', counting)
+    files = ftp.sync_site(opts)
+    assert [pathlib.Path(f).name for f in files] == ['large.bin']
+    assert fetched == [4096]
+    assert (opts.localdir / 'large.bin').read_bytes() == data
+
+
+def test_ftp_settings_follow_configure_and_spawn(local_ftp):
+    """Verify site settings come from the options, move with configure and
+    carry over to spawned connections."""
+    options, root = local_ftp
+    with ftp.connectmanager(options(blocksize=4096, mlsd=False)) as ftpcn:
+        assert (ftpcn._blocksize, ftpcn._mlsd, ftpcn._recipients) == (4096, False, [])
+        ftpcn.configure(options(blocksize=1024, pgp_recipients=['t@example.com']))
+        spawned = ftpcn.spawn()
+        try:
+            for cn in (ftpcn, spawned):
+                assert (cn._blocksize, cn._mlsd, cn._recipients) == (1024, True, ['t@example.com'])
+        finally:
+            spawned.close()
+    with pytest.raises(TypeError):
+        ftp.client.FtpConnection('127.0.0.1', 'foo', 'bar', block_size=1)
+
+
+def test_ftp_encrypted_upload_round_trip(local_ftp, gpg_keyring):
+    """Verify an upload encrypted on the way decrypts back to the original."""
+    options, root = local_ftp
+    data = b'id,value\n' + b'1,2\n' * 5000
+    with ftp.connectmanager(options()) as ftpcn:
+        ftpcn.putbinary(io.BytesIO(data), 'report.csv.pgp', recipients=[gpg_keyring])
+    assert (root / 'report.csv.pgp').read_bytes()[:64] != data[:64]
+    opts = options()
+    files = ftp.sync_site(opts)
+    assert [pathlib.Path(f).name for f in files] == ['report.csv']
+    assert (opts.localdir / 'report.csv').read_bytes() == data
+
+
+def test_ftp_getbinary_without_rest(local_ftp, monkeypatch):
+    """Verify a resume the server rejects falls back to a full download."""
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_REST',
+                        lambda self, line: self.respond('502 REST not implemented.'))
+    options, root = local_ftp
+    data = bytes(range(256)) * 64
+    (root / 'norest.bin').write_bytes(data)
+    localfile = options().localdir / 'norest.bin'
+    localfile.write_bytes(data[:100])
+    with ftp.connectmanager(options()) as ftpcn:
+        assert ftpcn.getbinary('norest.bin', localfile, offset=100) == len(data)
+    assert localfile.read_bytes() == data
+
+
+def test_sync_site_segmented_without_rest(local_ftp, monkeypatch):
+    """Verify segmented downloads fall back to one stream when REST is rejected."""
+    handlers = pytest.importorskip('pyftpdlib.handlers')
+    monkeypatch.setattr(handlers.FTPHandler, 'ftp_REST',
+                        lambda self, line: self.respond('502 REST not implemented.'))
+    options, root = local_ftp
+    data = bytes(range(256)) * 64
+    for name in ('one.bin', 'two.bin'):
+        (root / name).write_bytes(data)
+    opts = options(segment_threshold=1024, segments=4)
+    files = sync_site(opts)
+    assert sorted(pathlib.Path(f).name for f in files) == ['one.bin', 'two.bin']
+    assert (opts.localdir / 'one.bin').read_bytes() == data
+
+
+def test_sync_site_ignoreolderthan(local_ftp):
+    """Verify files older than the cutoff are counted as expired, not fetched."""
+    options, root = local_ftp
+    (root / 'agefile_new.txt').write_text('new')
+    (root / 'agefile_old.txt').write_text('old')
+    old = time.time() - 30 * 86400
+    os.utime(root / 'agefile_old.txt', (old, old))
+
+    opts = options(ignoreolderthan=7)
+    files = sync_site(opts)
+
+    assert [pathlib.Path(f).name for f in files] == ['agefile_new.txt']
+    assert opts.stats['expired'] == 1
+
+
+def test_sync_site_skip_dated_dirs(local_ftp):
+    """Verify dated directories are only skipped by name when asked to."""
+    options, root = local_ftp
+    (root / '2020').mkdir()
+    (root / '2020' / 'recent.txt').write_text('recent')
+
+    opts = options(ignoreolderthan=7)
+    assert [pathlib.Path(f).name for f in sync_site(opts)] == ['recent.txt']
+
+    opts = options(ignoreolderthan=7, skip_dated_dirs=True, ignorelocal=True)
+    assert sync_site(opts) == []
+    assert opts.stats['expired_dirs'] == 1
+    assert opts.stats['expired'] == 0
+
+
+def test_connection_pool_reuse(ftp_docker):
+    """Verify pooled connections are reused across connection managers."""
+    pool = ftp.ConnectionPool()
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.pool = pool
+
+    with ftp.connectmanager(options) as first:
+        assert first.pwd() == '/'
+    with ftp.connectmanager(options) as second:
+        assert second is first
+        second.cd('/')
+
+    pool.clear()
+    assert not first.ping()
+
+
+def test_connection_pool_applies_site_settings(ftp_docker):
+    """Verify a pooled connection takes the settings of each lease."""
+    pool = ftp.ConnectionPool()
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.pool = pool
+    with ftp.connectmanager(options) as first:
+        assert not first._recipients
+
+    options = ftp.FtpOptions.from_config('vendor.FOO.ftp', config)
+    options.pool = pool
+    options.pgp_recipients = ['ops@example.com']
+    options.blocksize = 65536
+    with ftp.connectmanager(options) as second:
+        assert second is first
+        assert second._recipients == ['ops@example.com']
+        assert second._blocksize == 65536
+    pool.clear()
+
+
 def test_ftp_nonstandard_port(clean_ftp_mount, ftp_docker_nonstandard_port):
     """Verify FTP connection works on non-standard port 2121.
 
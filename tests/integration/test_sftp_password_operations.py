@@ -1,6 +1,7 @@
 import contextlib
 import os
 
+import paramiko
 import pytest
 from tests import config
 from tests.fixtures.test_data import make_binary_file, make_text_file
@@ -161,5 +162,106 @@ def test_sftp_change_directory_with_password(clean_ftp_mount, sftp_docker):
         assert sftpcn.pwd() == initial_dir
 
 
+def test_sftp_spawn_channel_with_password(clean_ftp_mount, sftp_docker):
+    """Verify extra SFTP channels share the parent transport.
+
+    Tests that a spawned channel can transfer files and that closing it
+    leaves the parent connection usable.
+    """
+    localfile = os.path.join(config.tmpdir.dir, 'SftpChannel.dat')
+    make_binary_file(localfile, 1000)
+
+    with ftp.connectmanager('vendor.FOO.sftp', config) as sftpcn:
+        channel = sftpcn.spawn()
+        assert channel.ssh.get_transport() is sftpcn.ssh.get_transport()
+        assert channel.pwd() == sftpcn.pwd()
+        channel.putbinary(localfile, 'SftpChannel.dat')
+        channel.close()
+        assert sftpcn.ping()
+        assert 'SftpChannel.dat' in sftpcn.files()
+
+
+def test_sftp_get_segmented_with_password(clean_ftp_mount, sftp_docker):
+    """Verify segmented SFTP download reassembles the file.
+
+    Tests that byte ranges fetched over spawned channels are written at
+    the right offsets of the local file.
+    """
+    localfile = os.path.join(config.tmpdir.dir, 'SftpSegmented.dat')
+    make_binary_file(localfile, 100000)
+    size = os.path.getsize(localfile)
+
+    with ftp.connectmanager('vendor.FOO.sftp', config) as sftpcn:
+        sftpcn.putbinary(localfile, 'SftpSegmented.dat')
+        remotefile = os.path.join(config.tmpdir.dir, 'SftpSegmentedCopy.dat')
+        assert sftpcn.getsegmented('SftpSegmented.dat', remotefile, size, segments=3) == size
+        assert open(localfile, 'rb').read() == open(remotefile, 'rb').read()
+
+
+def test_sftp_request_settings_with_password(clean_ftp_mount, sftp_docker):
+    """Verify SFTP downloads with small read requests and few in flight.
+
+    Tests whole-file, ranged and segmented reads, which all prefetch with
+    the configured request size and concurrency.
+    """
+    localfile = os.path.join(config.tmpdir.dir, 'SftpRequests.dat')
+    make_binary_file(localfile, 100000)
+    data = open(localfile, 'rb').read()
+    options = ftp.FtpOptions.from_config('vendor.FOO.sftp', config=config)
+    options.sftp_request_size = 4096
+    options.sftp_max_requests = 3
+
+    with ftp.connectmanager(options) as sftpcn:
+        sftpcn.putbinary(localfile, 'SftpRequests.dat')
+        copy = os.path.join(config.tmpdir.dir, 'SftpRequestsCopy.dat')
+        assert sftpcn.getbinary('SftpRequests.dat', copy) == len(data)
+        assert open(copy, 'rb').read() == data
+        assert sftpcn.getsegmented('SftpRequests.dat', copy, len(data), segments=3) == len(data)
+        assert open(copy, 'rb').read() == data
+        assert b''.join(sftpcn.iter_bytes('SftpRequests.dat')) == data
+
+
+def test_sftp_bounded_writes_with_password(clean_ftp_mount, sftp_docker, monkeypatch):
+    """Verify pipelined SFTP uploads wait for acknowledgements every
+    `sftp_max_writes` requests and resume pipelining after each wait.
+
+    Tests the upload without the confirming stat as well.
+    """
+    localfile = os.path.join(config.tmpdir.dir, 'SftpWrites.dat')
+    make_binary_file(localfile, 100000)
+    data = open(localfile, 'rb').read()
+    options = ftp.FtpOptions.from_config('vendor.FOO.sftp', config=config)
+    options.sftp_request_size = 4096
+    options.sftp_max_writes = 4
+    options.sftp_confirm = False
+    calls = []
+    set_pipelined = paramiko.SFTPFile.set_pipelined
+    monkeypatch.setattr(paramiko.SFTPFile, 'set_pipelined',
+                        lambda self, pipelined=True: calls.append(pipelined) or set_pipelined(self, pipelined))
+
+    with ftp.connectmanager(options) as sftpcn:
+        assert sftpcn.putbinary(localfile, 'SftpWrites.dat') == len(data)
+        assert sftpcn.ftp.stat('SftpWrites.dat').st_size == len(data)
+        assert b''.join(sftpcn.iter_bytes('SftpWrites.dat')) == data
+    writes = -(-len(data) // 4096)
+    assert calls == [True] + [False, True] * (writes // 4)
+
+
+def test_sftp_iter_bytes_with_password(clean_ftp_mount, sftp_docker):
+    """Verify SFTP streaming reads return the remote file without a local copy.
+
+    Tests both the chunk iterator and the file-like reader.
+    """
+    localfile = os.path.join(config.tmpdir.dir, 'SftpStream.dat')
+    make_binary_file(localfile, 10000)
+    data = open(localfile, 'rb').read()
+
+    with ftp.connectmanager('vendor.FOO.sftp', config) as sftpcn:
+        sftpcn.putbinary(localfile, 'SftpStream.dat')
+        assert b''.join(sftpcn.iter_bytes('SftpStream.dat', 1000)) == data
+        with sftpcn.open_read('SftpStream.dat') as f:
+            assert f.read() == data
+
+
 if __name__ == '__main__':
     pytest.main([__file__])
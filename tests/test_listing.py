@@ -0,0 +1,130 @@
+from opendate import LCL, DateTime
+
+import pytest
+from ftp.client import Entry, LocalSnapshot, parse_find_listing, parse_ftp_dir_listing
+from ftp.client import parse_ftp_tree_listing, parse_mlsd_line
+
+
+def test_parse_find_listing():
+    """Verify find records parse after the root record."""
+    data = (b'd 4096 1700000000.5 \0'
+            b'd 4096 1700000001.0 sub\0'
+            b'f 12 1700000002.25 sub/a b.txt\0')
+    entries = parse_find_listing(data, LCL)
+    assert [(e.name, e.is_dir, e.size) for e in entries] == [
+        ('sub', True, 4096), ('sub/a b.txt', False, 12)]
+    assert entries[1].mtime == 1700000002
+
+
+@pytest.mark.parametrize('data', [b'', b'f 12 1700000002.25 a.txt\0'])
+def test_parse_find_listing_requires_root(data):
+    """Verify output without the root record (e.g. internal-sftp) is rejected."""
+    with pytest.raises(ValueError):
+        parse_find_listing(data, LCL)
+
+
+def test_parse_mlsd_line():
+    """Verify MLSD facts become an entry with a UTC mtime."""
+    entry = parse_mlsd_line('type=file;size=42;modify=20250102030405; a b.txt', LCL)
+    assert (entry.name, entry.is_dir, entry.size, entry.mtime) == ('a b.txt', False, 42, 1735787045)
+    assert parse_mlsd_line('type=cdir;modify=20250102030405; .', LCL) is None
+
+
+@pytest.mark.parametrize('line', ['type=file;size=1; nomodify.txt',
+                                  'type=file;size=1;modify=2025; short.txt'])
+def test_parse_mlsd_line_without_modify(line):
+    """Verify an entry without a usable modify fact is reported, not dropped."""
+    with pytest.raises(ValueError):
+        parse_mlsd_line(line, LCL)
+
+
+def _listed(lines, now):
+    entries, unparsed = parse_ftp_dir_listing(lines, LCL, now=DateTime(*now, tzinfo=LCL))
+    return [(e.name, e.datetime.year, e.datetime.month, e.datetime.day) for e in entries], unparsed
+
+
+def test_parse_ftp_dir_listing_year_rollover():
+    """Verify a yearless December date seen in January is last year's."""
+    lines = ['-rw-r--r--   1 u g  10 Dec 31 23:59 dec.txt',
+             '-rw-r--r--   1 u g  10 Jan  2 08:00 jan.txt',
+             '-rw-r--r--   1 u g  10 Jan  3 08:00 tomorrow.txt']
+    entries, _ = _listed(lines, (2025, 1, 2))
+    assert entries == [('dec.txt', 2024, 12, 31), ('jan.txt', 2025, 1, 2),
+                       ('tomorrow.txt', 2025, 1, 3)]
+
+
+@pytest.mark.parametrize(('now', 'year'), [((2024, 3, 10), 2024), ((2025, 1, 15), 2024),
+                                           ((2025, 3, 10), 2024)])
+def test_parse_ftp_dir_listing_leap_day(now, year):
+    """Verify a yearless Feb 29 resolves to a leap year."""
+    entries, _ = _listed(['-rw-r--r--   1 u g  10 Feb 29 10:00 leap.txt'], now)
+    assert entries == [('leap.txt', year, 2, 29)]
+
+
+def test_parse_ftp_dir_listing_unparsed():
+    """Verify total lines are skipped and garbage lines collected, across both patterns."""
+    lines = ['total 12',
+             'drwxr-xr-x 2   4100  4100  4096  Sep 07 17:54 incoming',
+             'garbage line',
+             '-rw-r--r--   1 500        19045 Sep  7 06:10 short form.csv',
+             '',
+             '-rw-r--r-- 1 u g 5 Jan 01  2020 dated.txt']
+    entries, unparsed = _listed(lines, (2025, 10, 1))
+    assert entries == [('incoming', 2025, 9, 7), ('short form.csv', 2025, 9, 7),
+                       ('dated.txt', 2020, 1, 1)]
+    assert unparsed == ['garbage line', '']
+
+
+TREE_LISTING = ['{root}:', 'total 8',
+                '-rw-r--r--   1 u g   12 Jan 01 10:00 a.txt',
+                'drwxr-xr-x   3 u g 4096 Jan 01 10:00 sub',
+                '',
+                '{root}/sub:', 'total 8',
+                '-rw-r--r--   1 u g    5 Jan 01 10:00 b.txt',
+                'drwxr-xr-x   2 u g 4096 Jan 01 10:00 deep',
+                '',
+                '{root}/sub/deep:', 'total 4',
+                '-rw-r--r--   1 u g    7 Jan 01 10:00 c.txt']
+
+
+@pytest.mark.parametrize(('header', 'root'), [('.', ''), ('/data', '/data'), ('/data', '/data/')])
+def test_parse_ftp_tree_listing(header, root):
+    """Verify nested section headers become paths relative to the root."""
+    lines = [line.format(root=header) for line in TREE_LISTING]
+    entries, unparsed = parse_ftp_tree_listing(lines, LCL, root)
+    assert [(e.name, e.is_dir, e.size) for e in entries] == [
+        ('a.txt', False, 12), ('sub', True, 4096), ('sub/b.txt', False, 5),
+        ('sub/deep', True, 4096), ('sub/deep/c.txt', False, 7)]
+    assert unparsed == []
+
+
+def test_parse_ftp_tree_listing_without_recursion():
+    """Verify a listing with a directory but no section for it is rejected."""
+    entries, _ = parse_ftp_tree_listing(TREE_LISTING[2:4], LCL)
+    assert entries is None
+
+
+def test_entry_hash_and_unpack():
+    """Verify entries hash like they compare and unpack like the old tuple."""
+    dt = DateTime(2025, 1, 2, 3, 4, 5, tzinfo=LCL)
+    entry = Entry('line', 'a.txt', False, 10, dt)
+    same = Entry(None, 'a.txt', False, 10, mtime=int(dt.timestamp()), tzinfo=LCL)
+    assert entry == same
+    assert len({entry, same, Entry(None, 'b.txt', False, 10, dt)}) == 2
+    line, name, is_dir, size, when = entry
+    assert (line, name, is_dir, size, when) == ('line', 'a.txt', False, 10, dt)
+
+
+def test_local_snapshot_stat(tmp_path):
+    """Verify lookups fall back to the .pgp copy and miss deleted files."""
+    (tmp_path / '.pgp').mkdir()
+    (tmp_path / 'a.txt').write_text('abc')
+    (tmp_path / '.pgp' / 'b.txt.pgp').write_text('b')
+    (tmp_path / 'gone.txt').write_text('x')
+    snapshot = LocalSnapshot()
+    assert sorted(snapshot.listing(tmp_path)) == ['a.txt', 'gone.txt']
+    (tmp_path / 'gone.txt').unlink()
+    assert snapshot.stat(tmp_path, 'a.txt') == (3, (tmp_path / 'a.txt').stat().st_mtime)
+    assert snapshot.stat(tmp_path, 'b.txt.pgp')[0] == 1
+    assert snapshot.stat(tmp_path, 'gone.txt') is None
+    assert snapshot.stat(tmp_path, 'missing.txt') is None
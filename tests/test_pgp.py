@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+from ftp.client import DecryptPool, Entry
+from ftp.options import FtpOptions
+from ftp.pgp import _archive_pgp_files, _pgp_jobs, _scan_folders, decrypt_all_pgp_files
+
+
+@pytest.fixture
+def site(tmp_path):
+    """A local site tree; the root is named so that no skip pattern matches it."""
+    root = tmp_path / 'site'
+    for folder in ('sub', '.pgp', '.part', 'archive/x'):
+        (root / folder).mkdir(parents=True)
+    for name in ('a.csv.pgp', 'sub/b.csv.pgp', '.pgp/done.csv.pgp', '.part/partial.csv.pgp',
+                 'archive/c.csv.pgp', 'archive/x/d.csv.pgp'):
+        (root / name).write_bytes(b'cipher')
+    return root
+
+
+def _scanned(root, **kw):
+    return {folder.relative_to(root).as_posix(): sorted(e.name for e in files)
+            for folder, files in _scan_folders(root, **kw)}
+
+
+def test_scan_folders_skips_archive_folders(site):
+    """Verify files in skipped folders are not yielded, but folders below them are."""
+    assert _scanned(site, workers=2) == {
+        '.': ['a.csv.pgp'], 'sub': ['b.csv.pgp'], 'archive/x': ['d.csv.pgp']}
+
+
+def test_scan_folders_prune(site):
+    """Verify prune leaves out everything below a skipped folder."""
+    assert _scanned(site, prune=True) == {'.': ['a.csv.pgp'], 'sub': ['b.csv.pgp']}
+
+
+def _jobs(root):
+    with os.scandir(root) as it:
+        entries = list(it)
+    return {job[0]: stale for job, stale in _pgp_jobs(FtpOptions(localdir=root), root, entries, None)}
+
+
+def test_pgp_jobs_up_to_date_and_stale(tmp_path):
+    """Verify only plaintext that is present, non-empty and newer counts as up to date."""
+    hour_ago = time.time() - 3600
+    for name in ('current', 'older', 'empty', 'missing'):
+        (tmp_path / f'{name}.csv.pgp').write_bytes(b'cipher')
+        os.utime(tmp_path / f'{name}.csv.pgp', (hour_ago, hour_ago))
+    (tmp_path / 'current.csv').write_text('plain')
+    (tmp_path / 'older.csv').write_text('plain')
+    os.utime(tmp_path / 'older.csv', (hour_ago - 60, hour_ago - 60))
+    (tmp_path / 'empty.csv').write_text('')
+    (tmp_path / 'notes.txt').write_text('not encrypted')
+    assert _jobs(tmp_path) == {'current.csv.pgp': False, 'older.csv.pgp': True,
+                               'empty.csv.pgp': True, 'missing.csv.pgp': True}
+
+
+def test_archive_pgp_files(tmp_path):
+    """Verify ciphertexts move to .pgp and only decrypted plaintexts are returned."""
+    for name in ('a.csv.pgp', 'b.csv.pgp'):
+        (tmp_path / name).write_bytes(b'cipher')
+    jobs = [('a.csv.pgp', 'a.csv', tmp_path), ('b.csv.pgp', 'b.csv', tmp_path)]
+    assert _archive_pgp_files(jobs, [True, False]) == [tmp_path / 'a.csv']
+    assert sorted(os.listdir(tmp_path / '.pgp')) == ['a.csv.pgp', 'b.csv.pgp']
+    assert not list(tmp_path.glob('*.csv.pgp'))
+
+
+def test_decrypt_all_pgp_files(site, monkeypatch):
+    """Verify stale files are decrypted, up-to-date ones only archived, and
+    files already in .pgp or in skipped folders left alone."""
+    decrypted = []
+
+    def fake_decrypt(options, pgpname, newname=None, _local=None):
+        decrypted.append((_local / pgpname).relative_to(site).as_posix())
+        (_local / newname).write_text('plain')
+
+    monkeypatch.setattr('ftp.pgp.decrypt_pgp_file', fake_decrypt)
+    (site / 'sub' / 'b.csv').write_text('plain')  # newer than its ciphertext
+    os.utime(site / 'sub' / 'b.csv.pgp', (time.time() - 60, time.time() - 60))
+    files = decrypt_all_pgp_files(FtpOptions(localdir=site))
+    assert sorted(f.relative_to(site).as_posix() for f in files) == ['a.csv', 'archive/x/d.csv']
+    assert sorted(decrypted) == ['a.csv.pgp', 'archive/x/d.csv.pgp']
+    assert (site / 'sub' / '.pgp' / 'b.csv.pgp').exists()
+    assert (site / '.pgp' / 'done.csv.pgp').exists()
+    assert (site / 'archive' / 'c.csv.pgp').exists()
+    assert (site / '.part' / 'partial.csv.pgp').exists()
+
+
+def test_decrypt_pool_join(tmp_path, monkeypatch, caplog):
+    """Verify join collects decrypted files in order and logs failures
+    without dropping the other jobs."""
+    def fake_decrypt(options, pgpname, newname=None, _local=None):
+        if pgpname.startswith('bad'):
+            raise RuntimeError('gpg failed')
+        (_local / newname).write_text('plain')
+
+    monkeypatch.setattr('ftp.client.decrypt_pgp_file', fake_decrypt)
+    names = ('a.csv.pgp', 'bad.csv.pgp', 'b.csv.pgp')
+    for name in names:
+        (tmp_path / name).write_bytes(b'cipher')
+    options = FtpOptions(localdir=tmp_path)
+    with DecryptPool(options, workers=2, backlog=1) as pool:
+        for name in names:
+            pool.submit(Entry(None, name, False, 6, mtime=0), tmp_path, '/')
+    assert pool.files == [tmp_path / 'a.csv', tmp_path / 'b.csv']
+    assert options.stats['decrypted'] == 2
+    assert sorted(os.listdir(tmp_path / '.pgp')) == ['a.csv.pgp', 'b.csv.pgp']
+    assert (tmp_path / 'bad.csv.pgp').exists()
+    assert 'Error decrypting file: bad.csv.pgp' in caplog.text